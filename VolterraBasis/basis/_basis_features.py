@@ -49,6 +49,51 @@ class LinearFeatures(TransformerMixin):
         return 0.5 * np.power(X, 2)
 
 
+# Coefficients (a_n, b_n, c_n) of the three-term recurrence P_{n+1} = (a_n x + b_n) P_n - c_n P_{n-1}, with P_0 = 1
+_recurrences = {
+    np.polynomial.Polynomial: lambda n: (1.0, 0.0, 0.0),
+    np.polynomial.Chebyshev: lambda n: (1.0 if n == 0 else 2.0, 0.0, 1.0),
+    np.polynomial.Legendre: lambda n: ((2 * n + 1) / (n + 1), 0.0, n / (n + 1)),
+    np.polynomial.Hermite: lambda n: (2.0, 0.0, 2.0 * n),
+    np.polynomial.HermiteE: lambda n: (1.0, 0.0, float(n)),
+    np.polynomial.Laguerre: lambda n: (-1 / (n + 1), (2 * n + 1) / (n + 1), n / (n + 1)),
+}
+
+
+def _recurrence_eval(X, degree, recurrence, max_order=0):
+    """
+    Evaluate all polynomials up to degree-1 and their derivatives up to max_order in a single pass.
+    Derivatives follow from differentiation of the recurrence
+    P^{(d)}_{n+1} = d a_n P^{(d-1)}_n + (a_n x + b_n) P^{(d)}_n - c_n P^{(d)}_{n-1}
+
+    Return array (max_order + 1, degree) + X.shape
+    """
+    res = np.zeros((max_order + 1, degree) + X.shape)
+    res[0, 0] = 1.0
+    for n in range(degree - 1):
+        a, b, c = recurrence(n)
+        factor = a * X + b if b != 0.0 else (X if a == 1.0 else a * X)
+        for d in range(max_order + 1):
+            np.multiply(factor, res[d, n], out=res[d, n + 1])
+            if d > 0:
+                res[d, n + 1] += d * a * res[d - 1, n]
+            if n > 0 and c != 0.0:
+                res[d, n + 1] -= c * res[d, n - 1]
+    return res
+
+
+def _diagonal_deriv(values, deriv_order):
+    """
+    Put values (nsamples, n_features, dim) of derivatives along each dimension into the array
+    (nsamples, n_features * dim) + (dim,) * deriv_order whose only nonzero elements are on the diagonal
+    """
+    nsamples, n_features, dim = values.shape
+    features = np.zeros((nsamples, n_features * dim) + (dim,) * deriv_order)
+    ind = np.arange(n_features * dim)
+    features[(slice(None), ind) + (ind % dim,) * deriv_order] = values.reshape(nsamples, n_features * dim)
+    return features
+
+
 class PolynomialFeatures(TransformerMixin):
     """
     Wrapper for numpy polynomial series.
@@ -71,6 +116,8 @@ class PolynomialFeatures(TransformerMixin):
 
     def basis(self, X):
         nsamples, dim = X.shape
+        if self.polynom in _recurrences:
+            return _recurrence_eval(X, self.degree, _recurrences[self.polynom])[0].transpose(1, 0, 2).reshape(nsamples, dim * self.degree)
 
         features = np.zeros((nsamples, dim * self.degree))
         for n in range(0, self.degree):
@@ -83,6 +130,9 @@ class PolynomialFeatures(TransformerMixin):
     def deriv(self, X, deriv_order=1):
         nsamples, dim = X.shape
         with_const = int(self.const_removed)
+        if self.polynom in _recurrences:
+            values = _recurrence_eval(X, self.degree, _recurrences[self.polynom], max_order=deriv_order)[deriv_order, with_const:]
+            return _diagonal_deriv(values.transpose(1, 0, 2), deriv_order)
         features = np.zeros((nsamples, dim * (self.degree - with_const)) + (dim,) * deriv_order)
         for n in range(with_const, self.degree):
             istart = (n - with_const) * dim
@@ -128,67 +178,58 @@ class FourierFeatures(TransformerMixin):
         self.dim_out_basis = 1
         return self
 
+    def _harmonics(self, X):
+        """
+        cos(m freq X) and sin(m freq X) for all harmonics m from angle addition recurrence, arrays (order // 2 + 1,) + X.shape
+        """
+        n_harm = self.order // 2
+        cos = np.empty((n_harm + 1,) + X.shape)
+        sin = np.empty((n_harm + 1,) + X.shape)
+        cos[0], sin[0] = 1.0, 0.0
+        if n_harm > 0:
+            cos[1], sin[1] = np.cos(self.freq * X), np.sin(self.freq * X)
+        for m in range(1, n_harm):
+            cos[m + 1] = cos[m] * cos[1] - sin[m] * sin[1]
+            sin[m + 1] = sin[m] * cos[1] + cos[m] * sin[1]
+        return cos, sin
+
+    def _derivatives(self, X, deriv_order=0):
+        """
+        Derivatives of order deriv_order of all elements of the basis, array (order,) + X.shape
+        """
+        cos, sin = self._harmonics(X)
+        factor = (np.arange(cos.shape[0]) * self.freq)[:, np.newaxis, np.newaxis] ** deriv_order / np.sqrt(np.pi)
+        # Derivatives of cos are cos, -sin, -cos, sin and derivatives of sin are sin, cos, -sin, -cos
+        cos_der = [cos, -sin, -cos, sin][deriv_order % 4] * factor
+        sin_der = [sin, cos, -sin, -cos][deriv_order % 4] * factor
+        features = np.empty((self.order,) + X.shape)
+        features[0] = 1.0 / np.sqrt(2 * np.pi) if deriv_order == 0 else 0.0
+        features[1::2] = sin_der[1:]
+        features[2::2] = cos_der[1:]
+        return features
+
     def basis(self, X):
         nsamples, dim = X.shape
-        features = np.zeros((nsamples, dim * self.order))
-        for n in range(0, self.order):
-            istart = n * dim
-            iend = (n + 1) * dim
-            if n == 0:
-                features[:, istart:iend] = np.ones_like(X) / np.sqrt(2 * np.pi)
-            elif n % 2 == 0:
-                # print(n / 2)
-                features[:, istart:iend] = np.cos(n / 2 * X * self.freq) / np.sqrt(np.pi)
-            else:
-                # print((n + 1) / 2)
-                features[:, istart:iend] = np.sin((n + 1) / 2 * X * self.freq) / np.sqrt(np.pi)
-        return features
+        return self._derivatives(X).transpose(1, 0, 2).reshape(nsamples, dim * self.order)
 
     def deriv(self, X, deriv_order=1):
-        if deriv_order == 2:
-            return self.hessian(X)
-        nsamples, dim = X.shape
         with_const = int(self.const_removed)
-        features = np.zeros((nsamples, dim * (self.order - with_const)) + (dim,) * deriv_order)
-        for n in range(with_const, self.order):
-            istart = (n - with_const) * dim
-            for i in range(dim):
-                if n % 2 == 0:
-                    features[(Ellipsis, slice(istart + i, istart + i + 1)) + (i,) * deriv_order] = -n / 2 * self.freq * np.sin(n / 2 * self.freq * X[:, slice(i, i + 1)]) / np.sqrt(np.pi)
-                else:
-                    features[(Ellipsis, slice(istart + i, istart + i + 1)) + (i,) * deriv_order] = (n + 1) / 2 * self.freq * np.cos((n + 1) / 2 * self.freq * X[:, slice(i, i + 1)]) / np.sqrt(np.pi)
-        return features
+        return _diagonal_deriv(self._derivatives(X, deriv_order)[with_const:].transpose(1, 0, 2), deriv_order)
 
     def hessian(self, X):
-        nsamples, dim = X.shape
-        with_const = int(self.const_removed)
-        features = np.zeros((nsamples, dim * (self.order - with_const)) + (dim,) * 2)
-        for n in range(with_const, self.order):
-            istart = (n - with_const) * dim
-            for i in range(dim):
-                if n % 2 == 0:
-                    features[(Ellipsis, slice(istart + i, istart + i + 1)) + (i,) * 2] = -(((n / 2) * self.freq) ** 2) * np.cos(n / 2 * self.freq * X[:, slice(i, i + 1)]) / np.sqrt(np.pi)
-                else:
-                    features[(Ellipsis, slice(istart + i, istart + i + 1)) + (i,) * 2] = -(((n + 1) / 2 * self.freq) ** 2) * np.sin((n + 1) / 2 * self.freq * X[:, slice(i, i + 1)]) / np.sqrt(np.pi)
-        return features
+        return self.deriv(X, deriv_order=2)
 
     def antiderivative(self, X, order=1):
         if order > 1:
             raise NotImplementedError
         nsamples, dim = X.shape
-        features = np.zeros((nsamples, dim * self.order))
-        for n in range(0, self.order):
-            istart = n * dim
-            iend = (n + 1) * dim
-            if n == 0:
-                features[:, istart:iend] = X / np.sqrt(2 * np.pi)
-            elif n % 2 == 0:
-                # print(n / 2)
-                features[:, istart:iend] = np.sin(n / 2 * X * self.freq) / (np.sqrt(np.pi) * n / 2 * self.freq)
-            else:
-                # print((n + 1) / 2)
-                features[:, istart:iend] = -1 * np.cos((n + 1) / 2 * X * self.freq) / (np.sqrt(np.pi) * (n + 1) / 2 * self.freq)
-        return features
+        cos, sin = self._harmonics(X)
+        factor = np.sqrt(np.pi) * (np.arange(1, cos.shape[0]) * self.freq)[:, np.newaxis, np.newaxis]
+        features = np.empty((self.order,) + X.shape)
+        features[0] = X / np.sqrt(2 * np.pi)
+        features[1::2] = -cos[1:] / factor
+        features[2::2] = sin[1:] / factor
+        return features.transpose(1, 0, 2).reshape(nsamples, dim * self.order)
 
 
 class SplineFctFeatures(TransformerMixin):
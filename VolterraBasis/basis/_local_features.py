@@ -23,7 +23,75 @@ def _get_bspline_basis(knots, degree=3, periodic=False):
     return bsplines
 
 
-class BSplineFeatures(TransformerMixin):  # TODO replace current implementation by one using Bspline.basis_element
+def _bspline_local(x, t, k, der=0):
+    """
+    Evaluate the k+1 B-splines that are nonzero at each point with the de Boor recursion.
+    Points outside of the base interval use the polynomial of the closest interval, as done by splev.
+
+    Parameters
+    ----------
+    x : array (n_points,)
+    t : array
+        Knots
+    k : int
+        Degree of the B-splines
+    der : int
+        Order of the derivative
+
+    Returns
+    -------
+    values : array (n_points, k+1)
+        values[:, j] is the value of the B-spline first[:] + j
+    first : array (n_points,)
+        Index of the first nonzero B-spline
+    """
+    n = len(t) - k - 1
+    span = np.clip(np.searchsorted(t, x, side="right") - 1, k, n - 1)
+    left = [x - t[span + 1 - j] for j in range(k + 1)]
+    right = [t[span + j] - x for j in range(k + 1)]
+    values = [np.ones_like(x)]
+    for j in range(1, k - der + 1):  # Values of the B-splines of degree j-1 to j
+        saved = np.zeros_like(x)
+        new_values = []
+        for r in range(j):
+            temp = values[r] / (right[r + 1] + left[j - r])
+            new_values.append(saved + right[r + 1] * temp)
+            saved = left[j - r] * temp
+        values = new_values + [saved]
+    for p in range(k - der + 1, k + 1):  # Derivative of the B-splines of degree p from the ones of degree p-1
+        new_values = []
+        for j in range(p + 1):
+            i = span - p + j
+            term = np.zeros_like(x)
+            if j > 0:
+                denom = t[i + p] - t[i]
+                term += np.divide(values[j - 1], denom, out=np.zeros_like(x), where=denom > 0)
+            if j < p:
+                denom = t[i + p + 1] - t[i + 1]
+                term -= np.divide(values[j], denom, out=np.zeros_like(x), where=denom > 0)
+            new_values.append(p * term)
+        values = new_values
+    return np.stack(values, axis=-1), span - k
+
+
+def _bspline_design(x, t, k, n_basis, der=0, sparse=False):
+    """
+    Matrix of the values of the first n_basis B-splines at points x, as a dense array or a sparse.COO array.
+    """
+    values, first = _bspline_local(x, t, k, der=der)
+    cols = first[:, np.newaxis] + np.arange(k + 1)
+    rows = np.broadcast_to(np.arange(x.shape[0])[:, np.newaxis], cols.shape)
+    mask = cols < n_basis
+    if sparse:
+        import sparse as sp
+
+        return sp.COO(np.stack((rows[mask], cols[mask])), values[mask], shape=(x.shape[0], n_basis))
+    design = np.zeros((x.shape[0], n_basis))
+    design[rows[mask], cols[mask]] = values[mask]
+    return design
+
+
+class BSplineFeatures(TransformerMixin):
     """
     Bsplines features class
     """
@@ -53,43 +121,79 @@ class BSplineFeatures(TransformerMixin):  # TODO replace current implementation
         if knots is None:
             knots = np.linspace(describe_result.minmax[0], describe_result.minmax[1], self.n_knots)
         self.bsplines_ = _get_bspline_basis(knots, self.k, periodic=self.periodic)
+        self._antiderivatives = {}
         self._nsplines = len(self.bsplines_)
         self.n_output_features_ = len(self.bsplines_) * dim
         return self
 
     def basis(self, X):
         nsamples, dim = X.shape
-        features = np.zeros((nsamples, self.n_output_features_))
-        for ispline, spline in enumerate(self.bsplines_):
-            istart = ispline * dim
-            iend = (ispline + 1) * dim
-            features[:, istart:iend] = scipy.interpolate.splev(X, spline)
-        return features
+        knots, _, degree = self.bsplines_[0]
+        design = _bspline_design(np.ravel(X), knots, degree, self._nsplines)
+        return design.reshape(nsamples, dim, self._nsplines).transpose(0, 2, 1).reshape(nsamples, self.n_output_features_)
+
+    def basis_sparse(self, X):
+        """
+        Same as basis but return a sparse.COO array
+        """
+        nsamples, dim = X.shape
+        knots, _, degree = self.bsplines_[0]
+        design = _bspline_design(np.ravel(X), knots, degree, self._nsplines, sparse=True)
+        return design.reshape((nsamples, dim, self._nsplines)).transpose((0, 2, 1)).reshape((nsamples, self.n_output_features_))
+
+    def deriv_sparse(self, X, deriv_order=1):
+        """
+        Same as deriv but return a sparse.COO array
+        """
+        import sparse
+
+        nsamples, dim = X.shape
+        n_splines = self._nsplines - int(self.const_removed)
+        shape = (nsamples, dim * n_splines) + (dim,) * deriv_order
+        if self.k < deriv_order:
+            return sparse.zeros(shape)
+        knots, _, degree = self.bsplines_[0]
+        design = _bspline_design(np.ravel(X), knots, degree, n_splines, der=deriv_order, sparse=True).reshape((nsamples, dim, n_splines))
+        sample, i, spline = design.coords
+        coords = (sample, spline * dim + i) + (i,) * deriv_order
+        return sparse.COO(np.stack(coords), design.data, shape=shape)
+
+    def hessian_sparse(self, X):
+        return self.deriv_sparse(X, deriv_order=2)
 
     def deriv(self, X, deriv_order=1):
         nsamples, dim = X.shape
         with_const = int(self.const_removed)
-        features = np.zeros((nsamples, dim * (self._nsplines - with_const)) + (dim,) * deriv_order)
+        n_splines = self._nsplines - with_const
+        features = np.zeros((nsamples, dim * n_splines) + (dim,) * deriv_order)
         if self.k < deriv_order:
             return features
-        for ispline, spline in enumerate(self.bsplines_[: len(self.bsplines_) - with_const]):
-            istart = (ispline) * dim
-            for i in range(dim):
-                features[(Ellipsis, slice(istart + i, istart + i + 1)) + (i,) * deriv_order] = scipy.interpolate.splev(X[:, slice(i, i + 1)], spline, der=deriv_order)
+        knots, _, degree = self.bsplines_[0]
+        design = _bspline_design(np.ravel(X), knots, degree, n_splines, der=deriv_order).reshape(nsamples, dim, n_splines)
+        for i in range(dim):
+            features[(Ellipsis, slice(i, None, dim)) + (i,) * deriv_order] = design[:, i, :]
         return features
 
     def hessian(self, X):
         return self.deriv(X, deriv_order=2)
 
+    def __getstate__(self):  # Cached antiderivatives are not part of the fitted state, such that hashing the basis does not depend on them
+        state = self.__dict__.copy()
+        state.pop("_antiderivatives", None)
+        return state
+
     def antiderivative(self, X, order=1):
         nsamples, dim = X.shape
-        features = np.zeros((nsamples, self.n_output_features_))
-        for ispline, spline in enumerate(self.bsplines_):
-            istart = ispline * dim
-            iend = (ispline + 1) * dim
-            spline_int = scipy.interpolate.splantider(spline, n=order)
-            features[:, istart:iend] = scipy.interpolate.splev(X, spline_int)
-        return features
+        if not hasattr(self, "_antiderivatives"):
+            self._antiderivatives = {}
+        if order not in self._antiderivatives:  # All antiderivatives share the same knots
+            splines_int = [scipy.interpolate.splantider(spline, n=order) for spline in self.bsplines_]
+            knots, _, degree = splines_int[0]
+            n_coeffs = len(knots) - degree - 1
+            self._antiderivatives[order] = (knots, degree, np.stack([np.asarray(spline[1])[:n_coeffs] for spline in splines_int], axis=1))
+        knots, degree, coeffs = self._antiderivatives[order]
+        values = _bspline_design(np.ravel(X), knots, degree, coeffs.shape[0]) @ coeffs
+        return values.reshape(nsamples, dim, self._nsplines).transpose(0, 2, 1).reshape(nsamples, self.n_output_features_)
 
 
 def quartic(u, der=0):
@@ -241,6 +345,26 @@ class SmoothIndicatorFeatures(TransformerMixin):
     def hessian(self, X):
         return self.deriv(X, deriv_order=2)
 
+    def basis_sparse(self, X):
+        """
+        Same as basis but return a sparse.COO array, at most two indicator functions are nonzero at each point.
+        Computed from the dense evaluation, that is cheap for the few states of this basis.
+        """
+        import sparse
+
+        return sparse.COO.from_numpy(self.basis(X))
+
+    def deriv_sparse(self, X, deriv_order=1):
+        """
+        Same as deriv but return a sparse.COO array
+        """
+        import sparse
+
+        return sparse.COO.from_numpy(self.deriv(X, deriv_order=deriv_order))
+
+    def hessian_sparse(self, X):
+        return self.deriv_sparse(X, deriv_order=2)
+
     def antiderivative(self, X, order=1):
         raise NotImplementedError
 
@@ -0,0 +1,156 @@
+import os
+import functools
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import xarray as xr
+import joblib
+
+
+def trajectory_fingerprint(xva, variables=("x", "v", "a")):
+    """
+    Identity of a trajectory from the content of the variables used for basis evaluation.
+    Dask backed variables are identified by their graph name, that is deterministic, and are not read.
+    """
+    tokens = []
+    for name in variables:
+        if name in xva.data_vars:
+            data = xva[name].data
+            if hasattr(data, "dask"):
+                tokens.append((name, data.name))
+            else:
+                tokens.append((name, joblib.hash(np.asarray(data))))
+    return tokens
+
+
+def _is_lazy(value):
+    return isinstance(value, xr.DataArray) and value.chunks is not None
+
+
+class BasisCache(object):
+    """
+    Least recently used cache for basis evaluations, held in memory and optionally on disk.
+    Entries are keyed on the model type, the fitted basis parameters and the trajectory content,
+    such that modifying any of them invalidate the cache.
+    """
+
+    def __init__(self, maxsize=32, location=None):
+        """
+        Parameters
+        ----------
+        maxsize : int, default=32
+            Maximum number of evaluations kept in memory.
+        location : str, default=None
+            If given, evaluations are also stored in this directory and reused between sessions.
+        """
+        self.maxsize = int(maxsize)
+        self.location = location
+        if self.location is not None:
+            os.makedirs(self.location, exist_ok=True)
+        self._memory = OrderedDict()
+        self._fingerprints = {}  # Fingerprints of the registered trajectories, keyed by id
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):  # Do not send cached arrays to workers
+        state = self.__dict__.copy()
+        state["_memory"] = OrderedDict()
+        state["_fingerprints"] = {}
+        return state
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __contains__(self, key):
+        return key in self._memory or (self.location is not None and os.path.exists(self._filename(key)))
+
+    def register(self, xva):
+        """
+        Fingerprint a trajectory and keep it as long as the dataset is alive, such that the data are hashed only once.
+        Trajectories are assumed not to be modified in place afterward, register them again otherwise.
+        """
+        tokens = trajectory_fingerprint(xva)
+        ref = weakref.ref(xva, lambda _, key=id(xva), fingerprints=self._fingerprints: fingerprints.pop(key, None))
+        self._fingerprints[id(xva)] = (ref, tokens)
+        return tokens
+
+    def fingerprint(self, xva):
+        """
+        Fingerprint of a trajectory, registering it on first use
+        """
+        entry = self._fingerprints.get(id(xva))
+        if entry is not None and entry[0]() is xva:
+            return entry[1]
+        return self.register(xva)
+
+    def key(self, model, xva, compute_for):
+        P_range = None if model.P_range is None else np.asarray(model.P_range)
+        return joblib.hash((type(model).__qualname__, compute_for, model.dim_x, model.dim_obs, model.rank_projection, P_range, model.basis, self.fingerprint(xva)))
+
+    def _filename(self, key):
+        return os.path.join(self.location, key + ".pkl")
+
+    def get(self, key):
+        """
+        Return cached value or None
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+        if self.location is not None and os.path.exists(self._filename(key)):
+            value = joblib.load(self._filename(key))
+            self._store_memory(key, value)
+            self.hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        if isinstance(value, tuple):
+            value = tuple(val.persist() if _is_lazy(val) else val for val in value)
+        elif _is_lazy(value):
+            value = value.persist()
+        self._store_memory(key, value)
+        if self.location is not None:
+            if isinstance(value, tuple):
+                joblib.dump(tuple(val.compute() if _is_lazy(val) else val for val in value), self._filename(key))
+            else:
+                joblib.dump(value.compute() if _is_lazy(value) else value, self._filename(key))
+        return value
+
+    def _store_memory(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def clear(self, disk=False):
+        """
+        Empty the cache. If disk is set, remove also the stored files.
+        """
+        self._memory.clear()
+        if disk and self.location is not None:
+            for f in os.listdir(self.location):
+                if f.endswith(".pkl"):
+                    os.remove(os.path.join(self.location, f))
+
+
+def cached_basis_vector(func):
+    """
+    Decorator for basis_vector methods of the models, use the model basis_cache when it is set.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, xva, compute_for="corrs"):
+        cache = getattr(self, "basis_cache", None)
+        if cache is None or not isinstance(xva, xr.Dataset):
+            return func(self, xva, compute_for=compute_for)
+        key = cache.key(self, xva, compute_for)
+        value = cache.get(key)
+        if value is None:
+            value = cache.set(key, func(self, xva, compute_for=compute_for))
+        return value
+
+    return wrapper
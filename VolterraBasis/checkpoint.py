@@ -0,0 +1,95 @@
+import os
+import json
+
+import numpy as np
+import xarray as xr
+import joblib
+
+STATE_FILE = "state.json"
+BASIS_FILE = "basis.pkl"
+
+
+def _write_npy(filename, arr):
+    """
+    Write array into filename, through a temporary file such that an interrupted write never leave a truncated file.
+    """
+    tmp = filename + ".tmp.npy"
+    np.save(tmp, np.asarray(arr))
+    os.replace(tmp, filename)
+
+
+def read_state(directory):
+    """
+    Return the description of the checkpoint stored in directory, or None if there is none.
+    """
+    filename = os.path.join(directory, STATE_FILE)
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        return json.load(f)
+
+
+def save_arrays(directory, arrays, attrs=None, basis=None):
+    """
+    Save arrays into directory, one .npy file per array, and update the description of the checkpoint.
+    Arrays already in the checkpoint that are not given are kept.
+
+    Parameters
+    ----------
+    arrays : dict
+        Arrays to save, either numpy arrays or DataArray whose dimensions and coordinates are also stored.
+    attrs : dict, default=None
+        Scalar values to store, they should be serializable to json.
+    basis : object, default=None
+        Fitted basis, saved with joblib.
+    """
+    os.makedirs(directory, exist_ok=True)
+    state = read_state(directory) or {"arrays": {}, "attrs": {}}
+    for name, arr in arrays.items():
+        if arr is None:
+            continue
+        entry = {"dims": None, "coords": {}}
+        if isinstance(arr, xr.DataArray):
+            entry["dims"] = list(arr.dims)
+            for coord in arr.coords:
+                _write_npy(os.path.join(directory, "{}.{}.npy".format(name, coord)), arr[coord].values)
+                entry["coords"][coord] = list(arr[coord].dims)
+        _write_npy(os.path.join(directory, name + ".npy"), arr)
+        state["arrays"][name] = entry
+    if attrs is not None:
+        state["attrs"].update(attrs)
+    if basis is not None:
+        joblib.dump(basis, os.path.join(directory, BASIS_FILE + ".tmp"))
+        os.replace(os.path.join(directory, BASIS_FILE + ".tmp"), os.path.join(directory, BASIS_FILE))
+    tmp = os.path.join(directory, STATE_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, os.path.join(directory, STATE_FILE))  # The state is updated last, such that it only describes complete files
+
+
+def load_arrays(directory, mmap_mode="r"):
+    """
+    Load a checkpoint saved by save_arrays.
+    Arrays are memory-mapped by default, such that they are only read from disk when used.
+
+    Returns
+    -------
+    arrays : dict
+    attrs : dict
+    basis : fitted basis or None
+    """
+    state = read_state(directory)
+    if state is None:
+        raise ValueError("No checkpoint found in {}".format(directory))
+    arrays = {}
+    for name, entry in state["arrays"].items():
+        data = np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode)
+        if entry["dims"] is None:
+            arrays[name] = data
+        else:
+            coords = {coord: (dims, np.load(os.path.join(directory, "{}.{}.npy".format(name, coord)))) for coord, dims in entry["coords"].items()}
+            arrays[name] = xr.DataArray(data, dims=entry["dims"], coords=coords)
+    basis = None
+    if os.path.exists(os.path.join(directory, BASIS_FILE)):
+        basis = joblib.load(os.path.join(directory, BASIS_FILE))
+    return arrays, state["attrs"], basis
@@ -1,4 +1,16 @@
 import numpy as np
+import scipy.fft
+import scipy.sparse
+
+
+def _fft_length(len_dat, len_trunc, fast=False):
+    """
+    Length of the padded transform. When fast is set, use the smallest fast length
+    that avoids circular wrap up to len_trunc lags, otherwise double the next power of two.
+    """
+    if fast:
+        return scipy.fft.next_fast_len(len_dat + len_trunc - 1, real=True)
+    return 2 ** int(np.ceil((np.log(len_dat) / np.log(2))) + 1)
 
 
 def correlation_1D(a, b=None, trunc=None):
@@ -38,6 +50,206 @@ def correlation_ND(a, b=None, trunc=None):
     return cor
 
 
+def correlation_rfft_ND(a, b=None, trunc=None, workers=None):
+    """
+    Same as correlation_ND but using real transforms and the minimal fast padding length.
+    Time is along the last dimension per numpy broadcasting rules
+
+    Parameters
+    ----------
+    workers : int, default=None
+        Number of threads used by scipy.fft.
+    """
+    len_dat = a.shape[-1]
+    if trunc is not None:
+        len_trunc = min(len_dat, trunc)
+    else:
+        len_trunc = len_dat
+    n_fft = _fft_length(len_dat, len_trunc, fast=True)
+    fra = scipy.fft.rfft(a, n=n_fft, axis=-1, workers=workers)
+    if b is None:
+        sf = np.conj(fra)[np.newaxis, ...] * fra[:, np.newaxis, ...]
+    else:
+        frb = scipy.fft.rfft(b, n=n_fft, axis=-1, workers=workers)
+        sf = np.conj(fra) * frb
+    res = scipy.fft.irfft(sf, n=n_fft, axis=-1, workers=workers)
+    return res[..., :len_trunc] / np.arange(len_dat, len_dat - len_trunc, -1)
+
+
+def _transform(a, n_fft, fast=False, workers=None):
+    """
+    Padded transform along the last dimension
+    """
+    if fast:
+        return scipy.fft.rfft(a, n=n_fft, axis=-1, workers=workers)
+    return np.fft.fft(a, n=n_fft, axis=-1)
+
+
+def _inverse_transform(sf, n_fft, fast=False, workers=None):
+    """
+    Real part of the inverse transform along the last dimension
+    """
+    if fast:
+        return scipy.fft.irfft(sf, n=n_fft, axis=-1, workers=workers)
+    return np.real(np.fft.ifft(sf, axis=-1))
+
+
+def _sym_from_spectrum(fra, n_fft, len_trunc, fast=False, workers=None, max_elements=2**24):
+    """
+    Unnormalized autocorrelation matrix from the transform of the components of a signal.
+    Since C_ji(n) = C_ij(-n), each unordered pair of components is transformed back only once.
+    Pairs are processed by blocks such that at most max_elements values of their products are held at once.
+    """
+    iu, ju = np.triu_indices(fra.shape[0])
+    cor = np.empty((fra.shape[0], fra.shape[0], len_trunc))
+    step = max(1, max_elements // fra[0].size)
+    for start in range(0, len(iu), step):
+        i, j = iu[start : start + step], ju[start : start + step]
+        res = _inverse_transform(np.conj(fra[i]) * fra[j], n_fft, fast=fast, workers=workers)
+        cor[i, j, :] = res[:, :len_trunc]
+        cor[j, i, :] = res[:, -np.arange(len_trunc)]  # Negative lags
+    return cor
+
+
+def _cross_from_spectrum(fra, frb, n_fft, len_trunc, fast=False, workers=None, max_elements=2**24):
+    """
+    Unnormalized correlation matrix from the transforms of the components of two signals.
+    Components of the first signal are processed by blocks such that at most max_elements values of the products are held at once.
+    """
+    cor = np.empty((fra.shape[0], frb.shape[0], len_trunc))
+    step = max(1, max_elements // frb.size)
+    for start in range(0, fra.shape[0], step):
+        cor[start : start + step] = _inverse_transform(np.conj(fra[start : start + step])[:, np.newaxis, :] * frb[np.newaxis, :, :], n_fft, fast=fast, workers=workers)[..., :len_trunc]
+    return cor
+
+
+def correlation_spectra_ND(*signals, pairs, trunc=None, fast=False, workers=None, max_elements=2**24):
+    """
+    Compute several correlations between a set of signals, each signal being transformed only once.
+    Components are along the first dimension and time along the last one.
+    Return a tuple with for each pair (i, j) the correlation res[k, l, n] = <signals[i]_k(t) signals[j]_l(t+n)>
+
+    Parameters
+    ----------
+    signals : arrays
+        The signals, all with the same length in time.
+    pairs : list of tuple
+        Indices of the signals to correlate.
+    fast : bool, default=False
+        Use real transforms and the minimal fast padding length.
+    workers : int, default=None
+        Number of threads used by scipy.fft when fast is set.
+    max_elements : int, default=2**24
+        Components are transformed back by blocks, holding at most max_elements values of the products at once.
+    """
+    len_dat = signals[0].shape[-1]
+    if trunc is not None:
+        len_trunc = min(len_dat, trunc)
+    else:
+        len_trunc = len_dat
+    n_fft = _fft_length(len_dat, len_trunc, fast=fast)
+    spectra = {i: _transform(signals[i], n_fft, fast=fast, workers=workers) for i in sorted(set(np.ravel(pairs)))}
+    norm = np.arange(len_dat, len_dat - len_trunc, -1)
+    cors = []
+    for i, j in pairs:
+        if i == j:
+            cor = _sym_from_spectrum(spectra[i], n_fft, len_trunc, fast=fast, workers=workers, max_elements=max_elements)
+        else:
+            cor = _cross_from_spectrum(spectra[i], spectra[j], n_fft, len_trunc, fast=fast, workers=workers, max_elements=max_elements)
+        cors.append(cor / norm)
+    return tuple(cors)
+
+
+def _correlation_chunk(left, right, pairs, len_trunc, fast=False, workers=None):
+    """
+    Unnormalized correlations sum_t left[i]_k(t) right[j]_l(t+n) over one chunk of time.
+    left and right are dict of signals, the right ones extending len_trunc-1 time steps after the end of the chunk when possible.
+    """
+    len_chunk = next(iter(left.values())).shape[-1]
+    if fast:
+        n_fft = scipy.fft.next_fast_len(len_chunk + len_trunc - 1, real=True)
+    else:
+        n_fft = 2 ** int(np.ceil(np.log2(len_chunk + len_trunc - 1)))  # No circular wrap up to len_trunc lags
+    spectra_left = {i: _transform(sig, n_fft, fast=fast, workers=workers) for i, sig in left.items()}
+    spectra_right = {j: _transform(sig, n_fft, fast=fast, workers=workers) for j, sig in right.items()}
+    return tuple(_cross_from_spectrum(spectra_left[i], spectra_right[j], n_fft, len_trunc, fast=fast, workers=workers) for i, j in pairs)
+
+
+def correlation_chunks_ND(*signals, pairs, trunc=None, fast=False, workers=None):
+    """
+    Same as correlation_spectra_ND for dask arrays chunked along time.
+    Each chunk of time is correlated with the signals over the chunk and the len_trunc-1 following time steps (overlap-save)
+    and the partial sums are then reduced over the chunks. The time axis is never gathered into a single chunk,
+    such that memory use scale with the chunk size and not with the length of the signals.
+    Components are along the first dimension and time along the last one.
+    Return a tuple of dask arrays.
+
+    Parameters
+    ----------
+    signals : arrays
+        The signals, all with the same length in time. Chunks along time of the first signal are used for all of them.
+    pairs : list of tuple
+        Indices of the signals to correlate.
+    fast : bool, default=False
+        Use real transforms and the minimal fast padding length.
+    workers : int, default=None
+        Number of threads used by scipy.fft when fast is set.
+    """
+    import dask
+    import dask.array as da
+
+    signals = [da.asarray(sig) for sig in signals]
+    len_dat = signals[0].shape[-1]
+    if trunc is not None:
+        len_trunc = min(len_dat, trunc)
+    else:
+        len_trunc = len_dat
+    left_ind, right_ind = sorted(set(i for i, _ in pairs)), sorted(set(j for _, j in pairs))
+    chunk_func = dask.delayed(_correlation_chunk, pure=True, nout=len(pairs))
+    bounds = np.cumsum((0,) + signals[0].chunks[-1])
+    partials = [[] for _ in pairs]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        left = {i: signals[i][..., start:end] for i in left_ind}
+        right = {j: signals[j][..., start : min(end + len_trunc - 1, len_dat)] for j in right_ind}
+        res = chunk_func(left, right, pairs, len_trunc, fast=fast, workers=workers)
+        for n, (i, j) in enumerate(pairs):
+            partials[n].append(da.from_delayed(res[n], shape=(signals[i].shape[0], signals[j].shape[0], len_trunc), dtype=np.float64))
+    norm = np.arange(len_dat, len_dat - len_trunc, -1)
+    return tuple(da.stack(part).sum(axis=0) / norm for part in partials)
+
+
+def correlation_blocks_ND(a, b=None, trunc=None, block_size=None):
+    """
+    Correlation computed by consuming the time series in blocks (overlap-save).
+    Only the transforms are computed by blocks, such that their memory scale with the block size.
+    The inputs are held for the full time series, see Estimator_gle.compute_corrs for evaluation of the basis by blocks.
+    Time is along the last dimension per numpy broadcasting rules
+
+    Parameters
+    ----------
+    block_size : int, default=None
+        Number of time steps per block. If None, it is set to 4 times the truncation length.
+    """
+    if b is None:
+        a, b = a[np.newaxis, ...], a[:, np.newaxis, ...]
+    len_dat = a.shape[-1]
+    if trunc is not None:
+        len_trunc = min(len_dat, trunc)
+    else:
+        len_trunc = len_dat
+    if block_size is None:
+        block_size = 4 * len_trunc
+    block_size = int(min(max(block_size, 1), len_dat))
+    n_fft = 2 ** int(np.ceil(np.log2(block_size + len_trunc - 1)))  # No circular wrap up to len_trunc lags
+    res = np.zeros(np.broadcast_shapes(a.shape[:-1], b.shape[:-1]) + (len_trunc,))
+    for start in range(0, len_dat, block_size):
+        end = min(start + block_size, len_dat)
+        fra = np.fft.fft(a[..., start:end], n=n_fft, axis=-1)
+        frb = np.fft.fft(b[..., start : min(end + len_trunc - 1, len_dat)], n=n_fft, axis=-1)
+        res += np.real(np.fft.ifft(np.conj(fra) * frb, axis=-1)[..., :len_trunc])
+    return res / np.arange(len_dat, len_dat - len_trunc, -1)
+
+
 def correlation_direct_1D(a, b=None, trunc=None):
     if trunc is not None:
         len_trunc = min(a.shape[-1], trunc)
@@ -53,7 +265,6 @@ def correlation_direct_1D(a, b=None, trunc=None):
     return res
 
 
-# TODO: allow for sparse array
 def correlation_direct_ND(a, b=None, trunc=None):
     """
     Time is along the last dimension per numpy broadcasting rules
@@ -71,3 +282,40 @@ def correlation_direct_ND(a, b=None, trunc=None):
     for n in range(1, len_trunc):
         res[:, :, n] = (a[..., :-n] * b[..., n:]).sum(axis=-1) / (len_dat - n)
     return res
+
+
+def correlation_sparse_ND(a, b=None, trunc=None):
+    """
+    Correlation computed lag by lag from sparse products, such that the cost scale with the number of nonzero elements.
+    Contrary to the other functions, time is along the first dimension: a is (time, n_a) and b is (time, n_b).
+    a should be a scipy.sparse matrix, b can be sparse or dense.
+    a is transposed once and b is shifted in time through views of its arrays, such that nothing is copied at each lag.
+    Return array (n_a, n_b, trunc)
+    """
+    if b is None:
+        b = a
+    aT = scipy.sparse.csr_matrix(a).T.tocsr()
+    len_dat = aT.shape[1]
+    if trunc is not None:
+        len_trunc = min(len_dat, trunc)
+    else:
+        len_trunc = len_dat
+    if scipy.sparse.issparse(b):
+        b = scipy.sparse.csr_matrix(b)
+        # Row t of the shifted matrix is row t + n of b, the last n rows are empty
+        indptr = np.concatenate((b.indptr, np.full(len_trunc, b.indptr[-1])))
+
+        def shifted(n):
+            return scipy.sparse.csr_matrix((b.data[b.indptr[n] :], b.indices[b.indptr[n] :], indptr[n : n + len_dat + 1] - b.indptr[n]), shape=b.shape, copy=False)
+
+    else:
+        b = np.concatenate((np.asarray(b), np.zeros((len_trunc, b.shape[1]))))
+
+        def shifted(n):
+            return b[n : n + len_dat]
+
+    res = np.zeros((aT.shape[0], b.shape[1], len_trunc))
+    for n in range(len_trunc):
+        prod = aT @ shifted(n)
+        res[:, :, n] = (prod.toarray() if scipy.sparse.issparse(prod) else prod) / (len_dat - n)
+    return res
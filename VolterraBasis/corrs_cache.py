@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import joblib
+
+from .basis_cache import trajectory_fingerprint
+from .checkpoint import save_arrays, load_arrays, STATE_FILE
+
+CORRS_NAMES = ["bkdxcorrw", "dotbkdxcorrw", "bkbkcorrw", "dotbkbkcorrw"]
+
+
+class CorrelationCache(object):
+    """
+    Content-addressed cache of correlation functions stored on disk.
+    Entries are keyed on the trajectories content, the model and fitted basis, the truncation, the force coefficients
+    and the options of the correlation computation, such that jobs run again on unchanged inputs skip the computation.
+    Least recently used entries are removed when the size of the cache exceed max_size.
+    """
+
+    def __init__(self, location, max_size=None):
+        """
+        Parameters
+        ----------
+        location : str
+            Directory of the cache.
+        max_size : int, default=None
+            Maximum size of the cache in bytes. If None, the size is not limited.
+        """
+        self.location = os.fspath(location)
+        os.makedirs(self.location, exist_ok=True)
+        self.max_size = None if max_size is None else int(max_size)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries())
+
+    def key(self, model, xva_list, **kwargs):
+        """
+        Hash of all inputs of the correlation computation.
+        Options that do not change the result (number of threads) are ignored.
+        """
+        variables = tuple(dict.fromkeys(("x", "v", "a", model.L_obs)))
+        options = {k: v for k, v in kwargs.items() if k not in ["workers"]}
+        force_coeff = None if model.force_coeff is None else np.asarray(model.force_coeff)
+        trajs = [(xva["time"].shape[0], trajectory_fingerprint(xva, variables=variables)) for xva in xva_list]
+        return joblib.hash((type(model).__qualname__, model.basis, model.dim_x, model.dim_obs, model.L_obs, model.trunc_ind, model.dt, force_coeff, sorted(options.items()), trajs))
+
+    def _path(self, key):
+        return os.path.join(self.location, key)
+
+    def _entries(self):
+        return [f for f in os.listdir(self.location) if os.path.exists(os.path.join(self.location, f, STATE_FILE))]
+
+    @staticmethod
+    def _entry_size(path):
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+    def size(self):
+        """
+        Total size of the cache in bytes
+        """
+        return sum(self._entry_size(self._path(key)) for key in self._entries())
+
+    def get(self, key, mmap_mode="r"):
+        """
+        Return cached correlations as a tuple (bkdxcorrw, dotbkdxcorrw, bkbkcorrw, dotbkbkcorrw) or None
+        """
+        if not os.path.exists(os.path.join(self._path(key), STATE_FILE)):
+            self.misses += 1
+            return None
+        arrays, _, _ = load_arrays(self._path(key), mmap_mode=mmap_mode)
+        os.utime(os.path.join(self._path(key), STATE_FILE))  # Mark as recently used
+        self.hits += 1
+        return tuple(arrays[name] for name in CORRS_NAMES)
+
+    def set(self, key, value):
+        """
+        Store the tuple of correlations, then evict least recently used entries if needed
+        """
+        tmp = tempfile.mkdtemp(prefix=".tmp_", dir=self.location)
+        save_arrays(tmp, dict(zip(CORRS_NAMES, value)))
+        try:
+            os.replace(tmp, self._path(key))
+        except OSError:  # Already stored by a concurrent job
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._evict(keep=key)
+        return value
+
+    def _evict(self, keep=None):
+        """
+        Remove least recently used entries until the size of the cache is below max_size
+        """
+        if self.max_size is None:
+            return
+        entries = [(os.path.getmtime(os.path.join(self._path(key), STATE_FILE)), key) for key in self._entries() if key != keep]
+        total = self.size()
+        for _, key in sorted(entries):
+            if total <= self.max_size:
+                break
+            total -= self._entry_size(self._path(key))
+            shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        for key in self._entries():
+            shutil.rmtree(self._path(key), ignore_errors=True)
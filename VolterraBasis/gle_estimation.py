@@ -1,13 +1,84 @@
+import os
+import shutil
+import contextlib
+import tempfile
+import weakref
 import numpy as np
 import xarray as xr
 from scipy.integrate import trapezoid
 from scipy.stats import describe
 
 from .basis import sum_describe
+from .trajectories_handler import Trajectories_handler, to_shared_memmap
+from .checkpoint import save_arrays, load_arrays, read_state
+from .corrs_cache import CorrelationCache
+from .basis_cache import BasisCache
 
-from .correlation import correlation_1D, correlation_ND, correlation_direct_1D, correlation_direct_ND
+from .correlation import correlation_1D, correlation_ND, correlation_rfft_ND, correlation_spectra_ND, correlation_blocks_ND, correlation_direct_1D, correlation_direct_ND, correlation_sparse_ND, correlation_chunks_ND, _correlation_chunk
 
 from .fkernel import kernel_first_kind_trapz, kernel_first_kind_rect, kernel_first_kind_midpoint, kernel_second_kind_rect, kernel_second_kind_trapz
+from .volterra_fft import kernel_first_kind_trapz_fft, kernel_first_kind_rect_fft, kernel_first_kind_midpoint_fft, kernel_second_kind_rect_fft, kernel_second_kind_trapz_fft
+
+
+def _sparse_to_csr(E):
+    """
+    Convert sparse evaluation of the basis to a scipy.sparse matrix with the basis along the columns.
+    Trailing dimensions after the basis one are merged with time.
+    """
+    if E.ndim > 2:
+        E = E.transpose((0,) + tuple(range(2, E.ndim)) + (1,)).reshape((-1, E.shape[1]))
+    return E.tocsr()
+
+
+def _is_chunked(arr):
+    return isinstance(arr, xr.DataArray) and arr.chunks is not None
+
+
+def _compute_lazy(res):
+    """
+    Compute at once the dask backed results such that the shared parts of the graph (i.e. basis evaluation) are evaluated only once.
+    """
+    lazy = [i for i, arr in enumerate(res) if _is_chunked(arr)]
+    if lazy:
+        import dask
+
+        res = list(res)
+        for i, arr in zip(lazy, dask.compute(*[res[i] for i in lazy])):
+            res[i] = arr
+    return res
+
+
+def _correlation_spectra(signals, input_core_dims, output_core_dims, pairs, trunc, fast=False, workers=None):
+    """
+    Correlations between a set of xarray signals, see correlation_spectra_ND.
+    Dask backed signals are correlated chunk by chunk along time, see correlation_chunks_ND.
+    """
+    if any(_is_chunked(sig) for sig in signals) and all(sig.ndim == len(dims) for sig, dims in zip(signals, input_core_dims)):
+        corrs = correlation_chunks_ND(*[sig.transpose(*dims).data for sig, dims in zip(signals, input_core_dims)], pairs=pairs, trunc=trunc, fast=fast, workers=workers)
+        return tuple(xr.DataArray(cor, dims=dims) for cor, dims in zip(corrs, output_core_dims))
+    if len(pairs) == 1:  # apply_ufunc expects then a single output
+        return (xr.apply_ufunc(
+            lambda *args, **kwargs: correlation_spectra_ND(*args, **kwargs)[0],
+            *signals,
+            input_core_dims=input_core_dims,
+            output_core_dims=output_core_dims,
+            exclude_dims={"time"},
+            kwargs={"trunc": trunc, "pairs": pairs, "fast": fast, "workers": workers},
+            output_dtypes=[np.float64],
+            dask_gufunc_kwargs={"output_sizes": {"dim_basis'": signals[0].sizes["dim_basis"], "time_trunc": trunc}, "allow_rechunk": True},
+            dask="parallelized",
+        ),)
+    return xr.apply_ufunc(
+        correlation_spectra_ND,
+        *signals,
+        input_core_dims=input_core_dims,
+        output_core_dims=output_core_dims,
+        exclude_dims={"time"},
+        kwargs={"trunc": trunc, "pairs": pairs, "fast": fast, "workers": workers},
+        output_dtypes=[np.float64] * len(pairs),
+        dask_gufunc_kwargs={"output_sizes": {"dim_basis'": signals[0].sizes["dim_basis"], "time_trunc": trunc}, "allow_rechunk": True},
+        dask="parallelized",
+    )
 
 
 def solve_linear(G, b):  # Write also a sparse version
@@ -23,7 +94,10 @@ class Estimator_gle(object):
     The main class for the position dependent memory extraction holding all data.
     """
 
-    def __init__(self, xva_arg, model_class, basis, trunc=1.0, L_obs=None, saveall=True, prefix="", verbose=True, n_jobs=1, **kwargs):
+    _checkpoint_model_arrays = ["force_coeff", "gram_force", "gram_kernel", "eff_mass", "inv_mass_coeff", "kernel", "P_range"]
+    _checkpoint_corrs = ["bkdxcorrw", "dotbkdxcorrw", "bkbkcorrw", "dotbkbkcorrw"]
+
+    def __init__(self, xva_arg, model_class, basis, trunc=1.0, L_obs=None, saveall=True, prefix="", verbose=True, n_jobs=1, checkpoint=None, **kwargs):
         """
         Create an instance of the Pos_gle class.
 
@@ -33,6 +107,8 @@ class Estimator_gle(object):
             Use compute_va() or see its output for format details.
             The timeseries to analyze. It should be either a xarray timeseries
             or a listlike collection of them.
+            A directory of NetCDF/Zarr files or a Trajectories_handler can also be given,
+            trajectories are then read from disk when needed.
         basis :  scikit-learn transformer to get the element of the basis
                 This class should implement, basis() and deriv() function
                 and deal with periodicity of the data.
@@ -48,10 +124,18 @@ class Estimator_gle(object):
             time value.
         L_obs: str, default given by the model
             Name of the column containing the time derivative of the observable
+        n_jobs : int, default=1
+            Number of worker processes used to loop over the trajectories.
+            Trajectories are then shared with the workers through memory-mapped files.
+            The pool of workers is kept alive between computations, see close().
+        checkpoint : str, default=None
+            Directory of a checkpoint. Each completed stage is saved into it and,
+            if it already contains a checkpoint, the computation is resumed from it, see load_checkpoint.
         """
 
         # Create all internal variables
         self.saveall = saveall
+        self.checkpoint = checkpoint
         self.prefix = prefix
         self.verbose = verbose
 
@@ -75,6 +159,12 @@ class Estimator_gle(object):
             print(self.weights)
 
         self.n_jobs = int(n_jobs)
+        self._shared_xva_list = None
+        self._parallel = None
+        self._partial_stats = None  # Unnormalized sums of the statistics accumulated by partial_fit
+        self._partial_options = None
+        self._partial_count = 0  # Number of trajectories in the accumulated sums
+        self.corrs_cache = None
         if self.n_jobs <= 1:
             self.loop_over_trajs = self._loop_over_trajs_serial
         else:
@@ -102,10 +192,15 @@ class Estimator_gle(object):
                 if "eval" in func or "compute" in func or "func" in ["basis_vector"]:
                     setattr(self, func, getattr(self.model, func))
 
+        if self.checkpoint is not None and read_state(self.checkpoint) is not None:
+            self.load_checkpoint()
+
     def _do_check(self, xva_arg):
         if xva_arg is not None:
             if isinstance(xva_arg, xr.Dataset):
                 self.xva_list = [xva_arg]
+            elif isinstance(xva_arg, (str, os.PathLike)):
+                self.xva_list = Trajectories_handler(xva_arg)
             else:
                 self.xva_list = xva_arg
             for xva in self.xva_list:
@@ -156,37 +251,131 @@ class Estimator_gle(object):
         if model is None:
             model = self.model
         self.model.rank_projection = False
-        for i in range(len(self.xva_list)):
-            _, _, dE = model.basis_vector(self.xva_list[i])
-            self.xva_list[i].update({new_obs_name: dE.rename({"dim_basis": "dim_dE"})})
+        if isinstance(self.xva_list, Trajectories_handler):  # Trajectories are not kept in memory, so update them when they are opened
+
+            def add_dE(xva):
+                _, _, dE = model.basis_vector(xva)
+                return xva.assign({new_obs_name: dE.rename({"dim_basis": "dim_dE"})})
+
+            self.xva_list.add_transform(add_dE)
+            dE = self.xva_list[0][new_obs_name]
+        else:
+            for i in range(len(self.xva_list)):
+                _, _, dE = model.basis_vector(self.xva_list[i])
+                self.xva_list[i].update({new_obs_name: dE.rename({"dim_basis": "dim_dE"})})
+            self._shared_xva_list = None  # Shared copies are outdated
         self.model.L_obs = new_obs_name
         self.model.dim_obs = dE.shape[-1]
 
-    def _loop_over_trajs_serial(self, func, model, **kwargs):
+    def _weighted_sum(self, array_res, indices=None):
+        """
+        Sum of the results of each trajectory weighted by its length.
+        If indices is None, return the average over all trajectories, otherwise the unnormalized sum over the trajectories of indices.
+        """
+        res = [0.0] * len(array_res[0])
+        if indices is None:
+            for weight, single_res in zip(self.weights, array_res):
+                for i, arr in enumerate(single_res):
+                    res[i] += arr * weight / self.weightsum
+        else:
+            for ind, single_res in zip(indices, array_res):
+                for i, arr in enumerate(single_res):
+                    res[i] += arr * self.weights[ind]
+        return _compute_lazy(res)
+
+    def _loop_over_trajs_serial(self, func, model, indices=None, **kwargs):
         """
         A generator for iteration over trajectories
         """
         # Et voir alors pour faire une version parallélisé (en distribué)
-        array_res = [func(weight, xva, model, **kwargs) for weight, xva in zip(self.weights, self.xva_list)]
-        # print(array_res)
-        res = [0.0] * len(array_res[0])
-        for weight, single_res in zip(self.weights, array_res):
-            for i, arr in enumerate(single_res):
-                res[i] += arr * weight / self.weightsum
-        return res
+        if indices is None:
+            array_res = [func(weight, xva, model, **kwargs) for weight, xva in zip(self.weights, self.xva_list)]
+        else:
+            array_res = [func(self.weights[i], self.xva_list[i], model, **kwargs) for i in indices]
+        return self._weighted_sum(array_res, indices)
 
-    def _loop_over_trajs_parallel(self, func, model, **kwargs):
+    def _shared_trajs(self):
+        """
+        Put once the trajectories in memory-mapped files such that only references are sent to the workers.
+        """
+        if isinstance(self.xva_list, Trajectories_handler):  # Already on disk
+            return self.xva_list
+        if self._shared_xva_list is None:
+            self._shared_folder = tempfile.mkdtemp(prefix="volterra_trajs_")
+            weakref.finalize(self, shutil.rmtree, self._shared_folder, ignore_errors=True)
+            self._shared_xva_list = []
+        for n in range(len(self._shared_xva_list), len(self.xva_list)):  # Only trajectories added since last call are copied
+            self._shared_xva_list.append(to_shared_memmap(self.xva_list[n], self._shared_folder, prefix="traj_{}".format(n)))
+        return self._shared_xva_list
+
+    def _loop_over_trajs_parallel(self, func, model, indices=None, **kwargs):
         """
         A generator for iteration over trajectories
         """
         from joblib import Parallel, delayed
 
-        array_res = Parallel(n_jobs=self.n_jobs)(delayed(func)(weight, xva, model, **kwargs) for weight, xva in zip(self.weights, self.xva_list))
-        res = [0.0] * len(array_res[0])
-        for weight, single_res in zip(self.weights, array_res):
-            for i, arr in enumerate(single_res):
-                res[i] += arr * weight / self.weightsum
-        return res
+        if self._parallel is None:  # The pool of workers is kept alive between calls, until close()
+            self._parallel = Parallel(n_jobs=self.n_jobs, mmap_mode="r")
+            self._parallel.__enter__()
+            self._parallel_finalizer = weakref.finalize(self, self._parallel.__exit__, None, None, None)
+        shared = self._shared_trajs()
+        if indices is None:
+            array_res = self._parallel(delayed(func)(weight, xva, model, **kwargs) for weight, xva in zip(self.weights, shared))
+        else:
+            array_res = self._parallel(delayed(func)(self.weights[i], shared[i], model, **kwargs) for i in indices)
+        return self._weighted_sum(array_res, indices)
+
+    def close(self):
+        """
+        Shut down the pool of workers used when n_jobs > 1. A new one is started if needed by a later computation.
+        """
+        if self._parallel is not None:
+            self._parallel_finalizer()
+            self._parallel = None
+        return self
+
+    def add_trajectories(self, xva_arg):
+        """
+        Add new trajectories to the estimator. The basis is not fitted again.
+        Statistics are updated from the new trajectories only at the next call of partial_fit.
+        Other computations use all trajectories.
+
+        Parameters
+        ----------
+        xva_arg : xarray dataset or list of datasets.
+            The new trajectories, in the same format as at initialization.
+            When trajectories are read from files, a directory of files or a Trajectories_handler is expected instead.
+        """
+        if isinstance(xva_arg, xr.Dataset):
+            new_list = [xva_arg]
+        elif isinstance(xva_arg, (str, os.PathLike)):
+            new_list = Trajectories_handler(xva_arg)
+        else:
+            new_list = xva_arg
+        if isinstance(self.xva_list, Trajectories_handler) != isinstance(new_list, Trajectories_handler):
+            raise ValueError("Trajectories read from files can only be extended by files and trajectories in memory by datasets.")
+        trunc = self.xva_list[0]["time"][self.trunc_ind - 1]
+        for xva in new_list:
+            if "time" not in xva.dims:
+                raise Exception("Time is not a coordinate. Please provide dataset with time, " "or an iterable collection (i.e. list) " "of dataset with time.")
+            if xva.attrs.get("dt") != self.dt:
+                raise ValueError("New trajectories should have the same timestep.")
+            if xva["time"][-1] < trunc:
+                raise ValueError("New trajectories should be longer than the truncation time.")
+            for col in self.model.set_of_obs + [self.model.L_obs]:
+                if col not in xva.data_vars:
+                    raise Exception("Please provide dataset that include {} as variable .".format(col))
+        new_weights = np.array([xva["time"].shape[0] for xva in new_list], dtype=int)
+        if isinstance(self.xva_list, Trajectories_handler):
+            self.xva_list.files.extend(new_list.files)
+        else:
+            self.xva_list = list(self.xva_list) + list(new_list)
+        self.weights = np.concatenate((self.weights, new_weights))
+        self.weightsum = np.sum(self.weights)
+        if self.verbose:
+            print("Added trajectories with the following lengths:")
+            print(new_weights)
+        return self
 
     def compute_basis_mean(self, basis_type="force"):
         """
@@ -194,24 +383,39 @@ class Estimator_gle(object):
         """
         return self.loop_over_trajs(self._compute_basis_mean, self.model, basis_type=basis_type)[0]
 
-    def compute_gram_force(self):
+    def compute_gram_force(self, sparse=False):
+        """
+        Return gram matrix of the force part of the basis.
+
+        Parameters
+        ----------
+        sparse : bool, default=False
+            Use sparse evaluation of the basis, see compute_mean_force.
+        """
         if self.verbose:
             print("Calculate gram...")
-        avg_gram = self.loop_over_trajs(self._compute_gram, self.model, gram_type="force")[0]
+        avg_gram = self.loop_over_trajs(self._compute_gram_sparse if sparse else self._compute_gram, self.model, gram_type="force")[0]
         self.model.gram_force = avg_gram
         if self.verbose:
             print("Found gram:", avg_gram)
+        self._save_stage(["gram_force"])
         return self.model
 
-    def compute_gram_kernel(self):
+    def compute_gram_kernel(self, sparse=False):
         """
         Return gram matrix of the kernel part of the basis.
+
+        Parameters
+        ----------
+        sparse : bool, default=False
+            Use sparse evaluation of the basis, see compute_mean_force.
         """
         if self.verbose:
             print("Calculate kernel gram...")
-        self.model.gram_kernel = self.loop_over_trajs(self._compute_gram, self.model, gram_type="kernel")[0]
+        self.model.gram_kernel = self.loop_over_trajs(self._compute_gram_sparse if sparse else self._compute_gram, self.model, gram_type="kernel")[0]
         if self.model.rank_projection:
-            self.model.gram_kernel = np.einsum("lj,jk,mk->lm", self.model.P_range, self.gram_kernel, self.model.P_range)
+            self.model.gram_kernel = np.einsum("lj,jk,mk->lm", self.model.P_range, self.model.gram_kernel, self.model.P_range)
+        self._save_stage(["gram_kernel"])
         return self.model
 
     def compute_effective_mass(self):
@@ -225,6 +429,7 @@ class Estimator_gle(object):
 
         if self.verbose:
             print("Found effective mass:", self.model.eff_mass)
+        self._save_stage(["eff_mass"])
         return self.model
 
     def compute_pos_effective_mass(self):
@@ -235,17 +440,25 @@ class Estimator_gle(object):
             print("Calculate effective_mass...")
         pos_inv_mass, avg_gram = self.loop_over_trajs(self._compute_square_vel_pos, self.model)
         self.model.inv_mass_coeff = solve_linear(avg_gram, pos_inv_mass)
+        self._save_stage(["inv_mass_coeff"])
         return self.model
 
-    def compute_mean_force(self):
+    def compute_mean_force(self, sparse=False):
         """
         Computes the mean force from the trajectories.
+
+        Parameters
+        ----------
+        sparse : bool, default=False
+            Use sparse evaluation of the basis, such that the cost scale with the number of nonzero elements.
+            Only for Pos_gle model and local bases that implement basis_sparse(), such as BSplineFeatures or FEMScalarFeatures.
         """
         if self.verbose:
             print("Calculate mean force...")
-        avg_disp, avg_gram = self.loop_over_trajs(self._projection_on_basis, self.model)
+        avg_disp, avg_gram = self.loop_over_trajs(self._projection_on_basis_sparse if sparse else self._projection_on_basis, self.model)
         self.model.gram_force = avg_gram
         self.model.force_coeff = solve_linear(avg_gram, avg_disp)
+        self._save_stage(["force_coeff", "gram_force"])
         return self.model
 
     def set_zero_force(self):
@@ -261,15 +474,62 @@ class Estimator_gle(object):
             When large is true, it use a slower way to compute correlation that is less demanding in memory
         rank_tol: float, default=None
             Tolerance for rank computation in case of projection onto the range of the basis
+        method : {"fft", "rfft", "fft_blocks", "direct", "sparse"}, default="fft"
+            Algorithm for the correlation. "rfft" use real transforms with minimal padding.
+            "fft_blocks" evaluate the basis and correlate each trajectory by blocks of time,
+            such that memory use scale with the block size and not with the length of the trajectory.
+            "sparse" use sparse evaluation of the basis and lag by lag sparse products,
+            for local bases with many elements. Only for Pos_gle model and bases that implement
+            basis_sparse(), deriv_sparse() and hessian_sparse(), such as BSplineFeatures or SmoothIndicatorFeatures.
+        block_size : int, default=None
+            Number of time steps per block for the "fft_blocks" method.
+        workers : int, default=None
+            Number of threads for the transforms of the "rfft" method.
          second_order_method:bool, default = True
             If set to False do less computation but prevent to use second_order method in Volterra
+
+        For trajectories backed by dask arrays, the "fft", "rfft" and "fft_blocks" methods correlate each chunk of time
+        with the following trunc time steps and reduce the result over the chunks, such that the trajectories are never loaded at once.
         """
         if self.verbose:
             print("Calculate correlation functions...")
         if self.model.force_coeff is None:
             raise Exception("Mean force has not been computed.")
-        self.bkdxcorrw, self.dotbkdxcorrw, self.bkbkcorrw, self.dotbkbkcorrw = self.loop_over_trajs(self._correlation_ufunc, self.model, **kwargs)
+        corrs_func = self._correlation_sparse if kwargs.get("method") == "sparse" else self._correlation_ufunc
+        corrs = None
+        if self.corrs_cache is not None:
+            key = self.corrs_cache.key(self.model, self.xva_list, **kwargs)
+            corrs = self.corrs_cache.get(key)
+            if self.verbose and corrs is not None:
+                print("Found correlation functions in cache.")
+        if corrs is None:
+            corrs = self.loop_over_trajs(corrs_func, self.model, **kwargs)
+            if self.corrs_cache is not None:
+                self.corrs_cache.set(key, corrs)
+        self.bkdxcorrw, self.dotbkdxcorrw, self.bkbkcorrw, self.dotbkbkcorrw = corrs
+        return self._finalize_corrs(rank_tol)
+
+    def set_corrs_cache(self, location, max_size=None):
+        """
+        Look up the correlation functions computed by compute_corrs in a content-addressed cache on disk.
+        Entries are keyed on the trajectories, the basis, the truncation, the force coefficients and the correlation method,
+        such that running again a job on unchanged inputs skip the computation of the correlations.
+
+        Parameters
+        ----------
+        location : str
+            Directory of the cache. If None, disable the cache.
+        max_size : int, default=None
+            Maximum size of the cache in bytes, least recently used entries are removed above it. If None, the size is not limited.
+        """
+        self.corrs_cache = None if location is None else CorrelationCache(location, max_size=max_size)
+        return self.corrs_cache
 
+    def _finalize_corrs(self, rank_tol=None, save=True):
+        """
+        Projection on the range of the basis and saving of the correlation functions.
+        If save is False, nothing is written to disk.
+        """
         if self.model.rank_projection:
             if self.verbose:
                 print("Projection on range space...")
@@ -283,8 +543,118 @@ class Estimator_gle(object):
                 self.dotbkdxcorrw = xr.dot(P_range, self.dotbkdxcorrw.rename({"dim_basis": "dim_basis_old"}))
             if isinstance(self.dotbkbkcorrw, xr.DataArray):
                 self.dotbkbkcorrw = xr.dot(P_range_tranpose, P_range, self.dotbkbkcorrw.rename({"dim_basis": "dim_basis_old", "dim_basis'": "dim_basis_old'"}))
+        if not save:
+            return self.model
         if self.saveall:
             xr.Dataset({"bkbk": self.bkbkcorrw, "bkdx": self.bkdxcorrw, "dotbkbk": self.dotbkbkcorrw, "dotbkdx": self.dotbkdxcorrw}, coords={"time_trunc": np.arange(self.bkbkcorrw.shape[-1]) * self.dt}).to_netcdf(self.corrsfile)
+        self._save_stage(["force_coeff", "gram_force", "eff_mass", "gram_kernel", "P_range"] + self._checkpoint_corrs)
+        return self.model
+
+    def compute_fused(self, gram_kernel=True, rank_tol=None, **kwargs):
+        """
+        Compute the mean force, the effective mass, the gram matrix of the kernel basis and the correlation functions,
+        with a single evaluation of the basis per trajectory.
+
+        A first pass over the trajectories evaluates the basis once and accumulates the statistics of the mean force,
+        the effective mass and the kernel gram matrix. Basis values are kept in the basis cache of the model,
+        such that the second pass that computes the correlation functions does not evaluate the basis again.
+        If the model has no basis cache, a temporary one is used that holds the basis values of all trajectories in memory.
+        With n_jobs > 1, basis values are not sent back from the workers and the second pass evaluates the basis again,
+        unless the basis cache of the model is stored on disk (see set_basis_cache).
+
+        Parameters
+        ----------
+        gram_kernel : bool, default=True
+            Also compute the gram matrix of the kernel basis.
+        rank_tol, method, second_order_method, block_size, workers :
+            See compute_corrs. The "sparse" method is not available.
+        """
+        if kwargs.get("method") == "sparse":
+            raise ValueError("Fused computation is not available with sparse method.")
+        if self.verbose:
+            print("Calculate mean force, effective mass and correlation functions...")
+        with self._temporary_basis_cache(4 * len(self.xva_list)):
+            res = self.loop_over_trajs(self._fused_statistics, self.model, gram_kernel=gram_kernel)
+            self.model.gram_force = res[1]
+            self.model.force_coeff = solve_linear(res[1], res[0])
+            self.model.eff_mass = xr.DataArray(np.linalg.inv(res[2]), dims=("dim_x'", "dim_x"))
+            self.compute_corrs(rank_tol=rank_tol, **kwargs)
+        if gram_kernel:
+            self.model.gram_kernel = res[3]
+            if self.model.rank_projection:
+                self.model.gram_kernel = np.einsum("lj,jk,mk->lm", self.model.P_range, self.model.gram_kernel, self.model.P_range)
+            self._save_stage(["gram_kernel"])
+        return self.model
+
+    @contextlib.contextmanager
+    def _temporary_basis_cache(self, maxsize):
+        """
+        Cache basis evaluations in memory during the context, when the model has no basis cache
+        """
+        if self.model.basis_cache is not None:
+            yield self.model.basis_cache
+            return
+        self.model.basis_cache = BasisCache(maxsize=maxsize)
+        try:
+            yield self.model.basis_cache
+        finally:
+            self.model.basis_cache = None
+
+    def partial_fit(self, xva_arg=None, gram_kernel=True, rank_tol=None, method="fft", second_order_method=True, workers=None):
+        """
+        Incremental version of compute_fused.
+        Unnormalized sums of the per trajectory statistics are kept between calls, such that only trajectories
+        added since the last call are processed. The mean force, the effective mass, the gram matrices and the correlation functions
+        are then updated from the accumulated sums, the kernel can be computed again afterward.
+        New trajectories are independent of the previous ones, correlations across the junction of successive segments are not included.
+
+        Since the mean force change with new trajectories, correlations are accumulated with the observable and with the force basis,
+        and combined with the force coefficients at each call. This cost additional correlations compared to compute_corrs.
+        Nothing is written to disk, use save_checkpoint to store the state of the estimator.
+
+        Parameters
+        ----------
+        xva_arg : xarray dataset or list of datasets, default=None
+            New trajectories to add before the update, see add_trajectories.
+        gram_kernel : bool, default=True
+            Also compute the gram matrix of the kernel basis.
+        method : {"fft", "rfft"}, default="fft"
+            Algorithm for the correlation.
+        rank_tol, second_order_method, workers :
+            See compute_corrs. When gram_kernel, method or second_order_method change between calls,
+            the statistics are accumulated again over all trajectories.
+        """
+        if method not in ["fft", "rfft"]:
+            raise ValueError("Incremental computation is only available with fft or rfft method.")
+        if xva_arg is not None:
+            self.add_trajectories(xva_arg)
+        options = {"gram_kernel": gram_kernel, "method": method, "second_order_method": second_order_method}
+        if options != self._partial_options:
+            self._partial_stats, self._partial_options, self._partial_count = None, options, 0
+        if self._partial_count < len(self.xva_list):
+            if self.verbose:
+                print("Accumulate statistics of {} new trajectories...".format(len(self.xva_list) - self._partial_count))
+            with self._temporary_basis_cache(4):
+                res = self.loop_over_trajs(self._partial_statistics, self.model, indices=range(self._partial_count, len(self.xva_list)), workers=workers, **options)
+            if self._partial_stats is None:
+                self._partial_stats = res
+            else:
+                self._partial_stats = [acc + arr for acc, arr in zip(self._partial_stats, res)]
+            self._partial_count = len(self.xva_list)
+        res = [acc / self.weightsum for acc in self._partial_stats]
+        avg_disp, avg_gram, v2 = res[:3]
+        bkdx_obs, dotbkdx_obs, self.bkbkcorrw, self.dotbkbkcorrw, bkdx_force, dotbkdx_force = res[3 + int(gram_kernel) :]
+        self.model.gram_force = avg_gram
+        self.model.force_coeff = solve_linear(avg_gram, avg_disp)
+        self.model.eff_mass = xr.DataArray(np.linalg.inv(v2), dims=("dim_x'", "dim_x"))
+        force_coeff = self.model.force_coeff.rename({"dim_basis": "dim_basis_force"})
+        self.bkdxcorrw = bkdx_obs - xr.dot(bkdx_force, force_coeff, dims="dim_basis_force")
+        self.dotbkdxcorrw = dotbkdx_obs - xr.dot(dotbkdx_force, force_coeff, dims="dim_basis_force")
+        self._finalize_corrs(rank_tol, save=False)
+        if gram_kernel:
+            self.model.gram_kernel = res[3]
+            if self.model.rank_projection:
+                self.model.gram_kernel = np.einsum("lj,jk,mk->lm", self.model.P_range, self.model.gram_kernel, self.model.P_range)
         return self.model
 
     def compute_kernel(self, method="rectangular", k0=None):
@@ -294,7 +664,9 @@ class Estimator_gle(object):
         Parameters
         ----------
         method : {"rectangular", "midpoint", "midpoint_w_richardson","trapz","second_kind_rect","second_kind_trapz"}, default=rectangular
-            Choose numerical method of inversion of the volterra equation
+            Choose numerical method of inversion of the volterra equation.
+            Adding the suffix "_fft" (i.e. "trapz_fft") use a divide-and-conquer algorithm with FFT for the history sums,
+            that gives the same result in O(N log^2 N) instead of O(N^2) operations. Faster for long kernels.
         k0 : float, default=0.
             If you give a nonzero value for k0, this is used at time zero for the trapz and second kind method. If set to None,
             the F-routine will calculate k0 from the second kind memory equation.
@@ -308,7 +680,7 @@ class Estimator_gle(object):
         self.model.method = method  # Save used method
         if self.verbose:
             print("Use dt:", self.dt)
-        if k0 is None and method in ["trapz", "second_kind_rect", "second_kind_trapz"]:  # Then we should compute initial value from time derivative at zero
+        if k0 is None and method in ["trapz", "second_kind_rect", "second_kind_trapz", "trapz_fft", "second_kind_rect_fft", "second_kind_trapz_fft"]:  # Then we should compute initial value from time derivative at zero
             if self.dotbkdxcorrw is None:
                 raise Exception("Need correlation with derivative functions to compute the kernel using this method or provide initial value.")
             k0 = solve_linear(self.bkbkcorrw.isel(time_trunc=0), self.dotbkdxcorrw.isel(time_trunc=0)).to_numpy()
@@ -316,35 +688,100 @@ class Estimator_gle(object):
                 print("K0", k0)
                 # print("Gram", self.bkbkcorrw[0, :, :])
                 # print("Gram eigs", np.linalg.eigvals(self.bkbkcorrw[0, :, :]))
-        if method in ["rect", "rectangular"]:
-            kernel = kernel_first_kind_rect(self.bkbkcorrw.to_numpy(), self.bkdxcorrw.to_numpy(), self.dt)
-        elif method == "midpoint":  # Deal with not even data lenght
-            kernel = kernel_first_kind_midpoint(self.bkbkcorrw.to_numpy(), self.bkdxcorrw.to_numpy(), self.dt)
+        fast = method.endswith("_fft")
+        base_method = method[: -len("_fft")] if fast else method
+        if base_method in ["rect", "rectangular"]:
+            kernel = (kernel_first_kind_rect_fft if fast else kernel_first_kind_rect)(self.bkbkcorrw.to_numpy(), self.bkdxcorrw.to_numpy(), self.dt)
+        elif base_method == "midpoint":  # Deal with not even data lenght
+            kernel = (kernel_first_kind_midpoint_fft if fast else kernel_first_kind_midpoint)(self.bkbkcorrw.to_numpy(), self.bkdxcorrw.to_numpy(), self.dt)
             time_ker = time_ker[:-1:2]
-        elif method == "midpoint_w_richardson":
-            ker = kernel_first_kind_midpoint(self.bkbkcorrw.to_numpy(), self.bkdxcorrw.to_numpy(), self.dt)
-            ker_3 = kernel_first_kind_midpoint(self.bkbkcorrw.to_numpy()[:, :, ::3], self.bkdxcorrw.to_numpy()[:, :, ::3], 3 * self.dt)
+        elif base_method == "midpoint_w_richardson":
+            kernel_midpoint = kernel_first_kind_midpoint_fft if fast else kernel_first_kind_midpoint
+            ker = kernel_midpoint(self.bkbkcorrw.to_numpy(), self.bkdxcorrw.to_numpy(), self.dt)
+            ker_3 = kernel_midpoint(self.bkbkcorrw.to_numpy()[:, :, ::3], self.bkdxcorrw.to_numpy()[:, :, ::3], 3 * self.dt)
             kernel = (9 * ker[::3][: ker_3.shape[0]] - ker_3) / 8
             time_ker = time_ker[:-3:6]
-        elif method == "trapz":
-            ker = kernel_first_kind_trapz(k0, self.bkbkcorrw.to_numpy(), self.bkdxcorrw.to_numpy(), self.dt)
+        elif base_method == "trapz":
+            ker = (kernel_first_kind_trapz_fft if fast else kernel_first_kind_trapz)(k0, self.bkbkcorrw.to_numpy(), self.bkdxcorrw.to_numpy(), self.dt)
             kernel = 0.5 * (ker[1:-1, :, :] + 0.5 * (ker[:-2, :, :] + ker[2:, :, :]))  # Smoothing
             kernel = np.insert(kernel, 0, k0, axis=0)
             time_ker = time_ker[:-1]
-        elif method == "second_kind_rect":
+        elif base_method == "second_kind_rect":
             if self.dotbkdxcorrw is None or self.dotbkbkcorrw is None:
                 raise Exception("Need correlation with derivative functions to compute the kernel using this method, please use other method.")
-            kernel = kernel_second_kind_rect(k0, self.bkbkcorrw.isel(time_trunc=0).to_numpy(), self.dotbkbkcorrw.to_numpy(), self.dotbkdxcorrw.to_numpy(), self.dt)
-        elif method == "second_kind_trapz":
+            kernel = (kernel_second_kind_rect_fft if fast else kernel_second_kind_rect)(k0, self.bkbkcorrw.isel(time_trunc=0).to_numpy(), self.dotbkbkcorrw.to_numpy(), self.dotbkdxcorrw.to_numpy(), self.dt)
+        elif base_method == "second_kind_trapz":
             if self.dotbkdxcorrw is None or self.dotbkbkcorrw is None:
                 raise Exception("Need correlation with derivative functions to compute the kernel using this method, please use other method.")
-            kernel = kernel_second_kind_trapz(k0, self.bkbkcorrw.isel(time_trunc=0).to_numpy(), self.dotbkbkcorrw.to_numpy(), self.dotbkdxcorrw.to_numpy(), self.dt)
+            kernel = (kernel_second_kind_trapz_fft if fast else kernel_second_kind_trapz)(k0, self.bkbkcorrw.isel(time_trunc=0).to_numpy(), self.dotbkbkcorrw.to_numpy(), self.dotbkdxcorrw.to_numpy(), self.dt)
         else:
-            raise Exception("Method for volterra inversion is not in  {rectangular, midpoint, midpoint_w_richardson,trapz,second_kind_rect,second_kind_trapz}")
+            raise Exception("Method for volterra inversion is not in  {rectangular, midpoint, midpoint_w_richardson,trapz,second_kind_rect,second_kind_trapz} (with optional _fft suffix)")
 
         self.model.kernel = xr.DataArray(kernel, dims=("time_kernel", "dim_basis", self.bkdxcorrw.dims[1]), coords={"time_kernel": time_ker})
         if self.saveall:  # TODO: change to xarray save
             xr.Dataset({"kernel": self.model.kernel}).to_netcdf(self.kernelfile)
+        self._save_stage(["kernel"])
+        return self.model
+
+    def save_checkpoint(self, directory=None, names=None):
+        """
+        Save the fitted basis, the model coefficients, the gram matrices, the range projection and the correlation functions.
+        Arrays are stored as .npy files, such that load_checkpoint memory-maps them.
+
+        Parameters
+        ----------
+        directory : str, default=None
+            Directory of the checkpoint. Default to the one given at initialization.
+        names : list of str, default=None
+            Only save these quantities, the other ones already in the checkpoint are kept. Default to all computed quantities.
+        """
+        directory = self.checkpoint if directory is None else directory
+        if directory is None:
+            raise ValueError("No checkpoint directory given.")
+        if names is None:
+            names = self._checkpoint_model_arrays + self._checkpoint_corrs
+        arrays = {name: getattr(self.model if name in self._checkpoint_model_arrays else self, name, None) for name in names}
+        attrs = {"model_class": type(self.model).__name__, "dt": float(self.dt), "trunc_ind": int(self.model.trunc_ind), "L_obs": self.model.L_obs, "dim_obs": int(self.model.dim_obs), "rank_projection": bool(self.model.rank_projection), "method": self.model.method}
+        save_arrays(directory, arrays, attrs=attrs, basis=self.model.basis)
+
+    def _save_stage(self, names):
+        """
+        Save the quantities computed by a stage when a checkpoint directory is set
+        """
+        if self.checkpoint is not None:
+            self.save_checkpoint(names=names)
+
+    def load_checkpoint(self, directory=None, mmap_mode="r"):
+        """
+        Restore the state saved by save_checkpoint, computation can then be resumed from any completed stage.
+        For example, the kernel can be computed with another method without computing again the correlations.
+        The trajectories should be the same as the ones used for the checkpoint.
+
+        Parameters
+        ----------
+        directory : str, default=None
+            Directory of the checkpoint. Default to the one given at initialization.
+        mmap_mode : {None, "r", "r+", "c"}, default="r"
+            Memory-map mode of the arrays, see numpy.load. If None, arrays are loaded into memory.
+        """
+        directory = self.checkpoint if directory is None else directory
+        if directory is None:
+            raise ValueError("No checkpoint directory given.")
+        arrays, attrs, basis = load_arrays(directory, mmap_mode=mmap_mode)
+        if attrs["model_class"] != type(self.model).__name__:
+            raise ValueError("Checkpoint was computed with model {}.".format(attrs["model_class"]))
+        if attrs["trunc_ind"] != self.model.trunc_ind or not np.isclose(attrs["dt"], self.dt):
+            raise ValueError("Checkpoint was computed with a different timestep or truncation.")
+        if basis is not None:
+            if basis.n_output_features_ != self.model.N_basis_elt:
+                raise ValueError("Checkpoint was computed with a different basis.")
+            self.model.basis = basis
+        self.model.L_obs, self.model.dim_obs = attrs["L_obs"], attrs["dim_obs"]
+        self.model.rank_projection, self.model.method = attrs["rank_projection"], attrs["method"]
+        for name, arr in arrays.items():
+            setattr(self.model if name in self._checkpoint_model_arrays else self, name, arr)
+        if self.verbose:
+            print("Restored from checkpoint:", ", ".join(arrays))
         return self.model
 
     def check_volterra_inversion(self, return_diff=False):
@@ -370,11 +807,16 @@ class Estimator_gle(object):
         else:
             return res_int
 
-    def compute_projected_corrs(self, left_op=None):
+    def compute_projected_corrs(self, left_op=None, conv_method="direct"):
         """
         Compute correlation between noise and left_op using the projected correlations
+
+        Parameters
+        ----------
+        conv_method : {"direct", "fft"}, default="direct"
+            Algorithm used, see model.compute_corrs_w_noise
         """
-        return self.loop_over_trajs(self._corrs_w_noise, self.model, left_op=left_op)
+        return self.loop_over_trajs(self._corrs_w_noise, self.model, left_op=left_op, conv_method=conv_method)
 
     @staticmethod
     def _projection_on_basis(weight, xva, model, gram_type="force", **kwargs):
@@ -390,6 +832,17 @@ class Estimator_gle(object):
         avg_gram = xr.dot(E, E.rename({"dim_basis": "dim_basis'"})) / weight
         return avg_disp, avg_gram
 
+    @staticmethod
+    def _projection_on_basis_sparse(weight, xva, model, gram_type="force", **kwargs):
+        """
+        Same as _projection_on_basis using sparse evaluation of the basis
+        """
+        E = _sparse_to_csr(model.basis_vector_sparse(xva, compute_for=gram_type))
+        obs = xva[model.L_obs]
+        avg_disp = xr.DataArray(E.T @ np.asarray(obs) / weight, dims=["dim_basis", obs.dims[1]])
+        avg_gram = xr.DataArray((E.T @ E).toarray() / weight, dims=["dim_basis", "dim_basis'"])
+        return avg_disp, avg_gram
+
     @staticmethod
     def _compute_basis_mean(weight, xva, model, basis_type="force", **kwargs):
         """
@@ -407,6 +860,14 @@ class Estimator_gle(object):
         avg_gram = xr.dot(E, E.rename({"dim_basis": "dim_basis'"})) / weight
         return (avg_gram,)
 
+    @staticmethod
+    def _compute_gram_sparse(weight, xva, model, gram_type="force", **kwargs):
+        """
+        Same as _compute_gram using sparse evaluation of the basis
+        """
+        E = _sparse_to_csr(model.basis_vector_sparse(xva, compute_for=gram_type))
+        return (xr.DataArray((E.T @ E).toarray() / weight, dims=["dim_basis", "dim_basis'"]),)
+
     @staticmethod
     def _compute_square_vel(weight, xva, model, **kwargs):
         """
@@ -425,9 +886,10 @@ class Estimator_gle(object):
         return avg_disp, avg_gram
 
     @staticmethod
-    def _correlation_ufunc(weight, xva, model, method="fft", vectorize=False, second_order_method=True, **kwargs):
+    def _correlation_ufunc(weight, xva, model, method="fft", vectorize=False, second_order_method=True, block_size=None, workers=None, ortho=True, **kwargs):
         """
         Do the correlation
+        If ortho is False, correlate with the observable instead of its part orthogonal to the mean force.
         Return 4 array with dimensions
 
         bkbkcorrw :(trunc_ind, N_basis_elt_kernel, N_basis_elt_kernel)
@@ -441,14 +903,42 @@ class Estimator_gle(object):
             func = correlation_direct_ND
         elif method == "direct" and vectorize:
             func = correlation_direct_1D
+        elif method == "fft_blocks":
+            func = correlation_blocks_ND
+        elif method == "rfft":
+            func = correlation_rfft_ND
         else:
             func = correlation_ND
+        if method == "fft_blocks" and not _is_chunked(xva["x"]):
+            return Estimator_gle._correlation_blocks(weight, xva, model, second_order_method=second_order_method, block_size=block_size, ortho=ortho)
+        corr_kwargs = {"trunc": model.trunc_ind}
+        if method == "fft_blocks":
+            corr_kwargs["block_size"] = block_size
+        elif func is correlation_rfft_ND:
+            corr_kwargs["workers"] = workers
         E_force, E, dE = model.basis_vector(xva)
         # print(E_force, model.force_coeff)
-        ortho_xva = xva[model.L_obs] - xr.dot(E_force, model.force_coeff)
+        ortho_xva = xva[model.L_obs] - xr.dot(E_force, model.force_coeff) if ortho else xva[model.L_obs]
         # print(ortho_xva.head(), E.head())
+        if func in [correlation_ND, correlation_rfft_ND] or (func is correlation_blocks_ND and _is_chunked(E)):  # Transform E, dE and ortho_xva only once for all correlations
+            obs_dim = ortho_xva.dims[1]
+            signals = [E, ortho_xva]
+            input_core_dims = [["dim_basis", "time"], [obs_dim, "time"]]
+            pairs = [(0, 1), (0, 0)]
+            output_core_dims = [["dim_basis", obs_dim, "time_trunc"], ["dim_basis'", "dim_basis", "time_trunc"]]
+            if second_order_method:
+                signals.append(dE.rename({"dim_basis": "dim_basis_dot"}))
+                input_core_dims.append(["dim_basis_dot", "time"])
+                pairs += [(2, 1), (2, 0)]
+                output_core_dims += [["dim_basis_dot", obs_dim, "time_trunc"], ["dim_basis'", "dim_basis", "time_trunc"]]
+            corrs = _correlation_spectra(signals, input_core_dims, output_core_dims, pairs, model.trunc_ind, fast=func is not correlation_ND, workers=workers)
+            bkdxcorrw, bkbkcorrw = corrs[0], corrs[1]
+            if second_order_method:
+                return bkdxcorrw, corrs[2].rename({"dim_basis_dot": "dim_basis"}), bkbkcorrw, corrs[3]
+            # We can compute only the first element then, that is faster
+            return bkdxcorrw, xr.dot(dE, ortho_xva).expand_dims({"time_trunc": 1}) / weight, bkbkcorrw, np.array([[0.0]])
         bkdxcorrw = xr.apply_ufunc(
-            func, E, ortho_xva, input_core_dims=[["time"], ["time"]], output_core_dims=[["time_trunc"]], exclude_dims={"time"}, kwargs={"trunc": model.trunc_ind}, dask_gufunc_kwargs={"output_sizes": {"time_trunc": model.trunc_ind}, "allow_rechunk": True}, vectorize=vectorize, dask="parallelized"
+            func, E, ortho_xva, input_core_dims=[["time"], ["time"]], output_core_dims=[["time_trunc"]], exclude_dims={"time"}, kwargs=corr_kwargs, dask_gufunc_kwargs={"output_sizes": {"time_trunc": model.trunc_ind}, "allow_rechunk": True}, vectorize=vectorize, dask="parallelized"
         )
         bkbkcorrw = xr.apply_ufunc(
             func,
@@ -457,7 +947,7 @@ class Estimator_gle(object):
             input_core_dims=[["time"], ["time"]],
             output_core_dims=[["time_trunc"]],
             exclude_dims={"time"},
-            kwargs={"trunc": model.trunc_ind},
+            kwargs=corr_kwargs,
             dask_gufunc_kwargs={"output_sizes": {"time_trunc": model.trunc_ind}, "allow_rechunk": True},
             vectorize=vectorize,
             dask="parallelized",
@@ -470,7 +960,7 @@ class Estimator_gle(object):
                 input_core_dims=[["time"], ["time"]],
                 output_core_dims=[["time_trunc"]],
                 exclude_dims={"time"},
-                kwargs={"trunc": model.trunc_ind},
+                kwargs=corr_kwargs,
                 dask_gufunc_kwargs={"output_sizes": {"time_trunc": model.trunc_ind}, "allow_rechunk": True},
                 vectorize=vectorize,
                 dask="parallelized",
@@ -482,7 +972,7 @@ class Estimator_gle(object):
                 input_core_dims=[["time"], ["time"]],
                 output_core_dims=[["time_trunc"]],
                 exclude_dims={"time"},
-                kwargs={"trunc": model.trunc_ind},
+                kwargs=corr_kwargs,
                 dask_gufunc_kwargs={"output_sizes": {"time_trunc": model.trunc_ind}, "allow_rechunk": True},
                 vectorize=vectorize,
                 dask="parallelized",
@@ -494,8 +984,114 @@ class Estimator_gle(object):
         return bkdxcorrw, dotbkdxcorrw, bkbkcorrw, dotbkbkcorrw
 
     @staticmethod
-    def _corrs_w_noise(weight, xva, model, left_op=None, **kwargs):
+    def _correlation_blocks(weight, xva, model, second_order_method=True, block_size=None, ortho=True, **kwargs):
+        """
+        Same as _correlation_ufunc, consuming the trajectory by blocks of time (overlap-save).
+        The basis and the orthogonal part of the observable are evaluated on each block and the trunc_ind-1 following time steps,
+        such that memory use scale with the block size and not with the length of the trajectory.
+        """
+        len_dat = xva["time"].shape[0]
+        len_trunc = min(len_dat, model.trunc_ind)
+        if block_size is None:
+            block_size = 4 * len_trunc
+        block_size = int(min(max(block_size, 1), len_dat))
+        pairs = [(0, 1), (0, 0)] + ([(2, 1), (2, 0)] if second_order_method else [])
+        sums = None
+        dotbkdx = 0.0
+        for start in range(0, len_dat, block_size):
+            end = min(start + block_size, len_dat)
+            xva_block = xva.isel(time=slice(start, min(end + len_trunc - 1, len_dat)))
+            E_force, E, dE = model.basis_vector(xva_block)
+            ortho_xva = xva_block[model.L_obs] - xr.dot(E_force, model.force_coeff) if ortho else xva_block[model.L_obs]
+            obs_dim = ortho_xva.dims[1]
+            right = {0: E.transpose("dim_basis", "time").to_numpy(), 1: ortho_xva.transpose(obs_dim, "time").to_numpy()}
+            left = {0: right[0][:, : end - start]}
+            if second_order_method:
+                left[2] = dE.transpose("dim_basis", "time").to_numpy()[:, : end - start]
+            else:
+                dotbkdx = dotbkdx + xr.dot(dE.isel(time=slice(0, end - start)), ortho_xva.isel(time=slice(0, end - start)))
+            block_sums = _correlation_chunk(left, right, pairs, len_trunc)
+            sums = block_sums if sums is None else [acc + arr for acc, arr in zip(sums, block_sums)]
+        norm = np.arange(len_dat, len_dat - len_trunc, -1)
+        bkdxcorrw = xr.DataArray(sums[0] / norm, dims=["dim_basis", obs_dim, "time_trunc"])
+        bkbkcorrw = xr.DataArray(sums[1] / norm, dims=["dim_basis'", "dim_basis", "time_trunc"])
+        if second_order_method:
+            return bkdxcorrw, xr.DataArray(sums[2] / norm, dims=["dim_basis", obs_dim, "time_trunc"]), bkbkcorrw, xr.DataArray(sums[3] / norm, dims=["dim_basis'", "dim_basis", "time_trunc"])
+        # We can compute only the first element then, that is faster
+        return bkdxcorrw, dotbkdx.expand_dims({"time_trunc": 1}) / weight, bkbkcorrw, np.array([[0.0]])
+
+    @staticmethod
+    def _correlation_sparse(weight, xva, model, second_order_method=True, **kwargs):
+        """
+        Same as _correlation_ufunc using sparse evaluation of the basis and sparse correlations.
+        """
+        E_force, E, dE = model.basis_vector_sparse(xva)
+        obs = xva[model.L_obs]
+        obs_dim = obs.dims[1]
+        ortho_xva = np.asarray(obs) - _sparse_to_csr(E_force) @ np.asarray(model.force_coeff)
+        E, dE = _sparse_to_csr(E), _sparse_to_csr(dE)
+        bkdxcorrw = xr.DataArray(correlation_sparse_ND(E, ortho_xva, trunc=model.trunc_ind), dims=["dim_basis", obs_dim, "time_trunc"])
+        bkbkcorrw = xr.DataArray(correlation_sparse_ND(E, E, trunc=model.trunc_ind), dims=["dim_basis'", "dim_basis", "time_trunc"])
+        if second_order_method:
+            dotbkdxcorrw = xr.DataArray(correlation_sparse_ND(dE, ortho_xva, trunc=model.trunc_ind), dims=["dim_basis", obs_dim, "time_trunc"])
+            dotbkbkcorrw = xr.DataArray(correlation_sparse_ND(dE, E, trunc=model.trunc_ind), dims=["dim_basis'", "dim_basis", "time_trunc"])
+        else:
+            # Same as the dense evaluation in _correlation_ufunc
+            dotbkdxcorrw = xr.DataArray(dE.T @ ortho_xva, dims=["dim_basis", obs_dim]).expand_dims({"time_trunc": 1}) / weight
+            dotbkbkcorrw = np.array([[0.0]])
+        return bkdxcorrw, dotbkdxcorrw, bkbkcorrw, dotbkbkcorrw
+
+    @staticmethod
+    def _fused_statistics(weight, xva, model, gram_kernel=True, **kwargs):
+        """
+        Statistics of the mean force, the effective mass and the kernel gram matrix for one traj.
+        The basis is evaluated once, other functions get the values from the basis cache of the model.
+        """
+        model.basis_vector_fused(xva)
+        res = Estimator_gle._projection_on_basis(weight, xva, model) + Estimator_gle._compute_square_vel(weight, xva, model)
+        if gram_kernel:
+            res += Estimator_gle._compute_gram(weight, xva, model, gram_type="kernel")
+        return res
+
+    @staticmethod
+    def _partial_statistics(weight, xva, model, gram_kernel=True, method="fft", second_order_method=True, workers=None, **kwargs):
+        """
+        Statistics of one traj for partial_fit, the basis is evaluated once.
+        Correlations are computed with the observable and with the force basis, to be combined with the force coefficients afterward.
+        """
+        res = Estimator_gle._fused_statistics(weight, xva, model, gram_kernel=gram_kernel)
+        res += Estimator_gle._correlation_ufunc(weight, xva, model, method=method, second_order_method=second_order_method, workers=workers, ortho=False)
+        return res + Estimator_gle._correlation_force(weight, xva, model, method=method, second_order_method=second_order_method, workers=workers)
+
+    @staticmethod
+    def _correlation_force(weight, xva, model, method="fft", second_order_method=True, workers=None, **kwargs):
+        """
+        Correlations of the basis with the force basis for one traj
+        Return 2 array with dimensions
+
+        bkforcecorrw :(N_basis_elt_kernel, N_basis_elt_force, trunc_ind)
+        dotbkforcecorrw :(N_basis_elt_kernel, N_basis_elt_force, trunc_ind)
+        """
+        E_force, E, dE = model.basis_vector(xva)
+        E_force = E_force.rename({"dim_basis": "dim_basis_force"})
+        signals = [E, E_force]
+        input_core_dims = [["dim_basis", "time"], ["dim_basis_force", "time"]]
+        pairs = [(0, 1)]
+        output_core_dims = [["dim_basis", "dim_basis_force", "time_trunc"]]
+        if second_order_method:
+            signals.append(dE.rename({"dim_basis": "dim_basis_dot"}))
+            input_core_dims.append(["dim_basis_dot", "time"])
+            pairs.append((2, 1))
+            output_core_dims.append(["dim_basis_dot", "dim_basis_force", "time_trunc"])
+        corrs = _correlation_spectra(signals, input_core_dims, output_core_dims, pairs, model.trunc_ind, fast=method == "rfft", workers=workers)
+        if second_order_method:
+            return corrs[0], corrs[1].rename({"dim_basis_dot": "dim_basis"})
+        # We can compute only the first element then, that is faster
+        return corrs[0], xr.dot(dE, E_force).expand_dims({"time_trunc": 1}) / weight
+
+    @staticmethod
+    def _corrs_w_noise(weight, xva, model, left_op=None, conv_method="direct", **kwargs):
         """
         Do the needed scalar product for one traj
         """
-        return model.compute_corrs_w_noise(xva, left_op)
+        return model.compute_corrs_w_noise(xva, left_op, conv_method=conv_method)
@@ -1,6 +1,13 @@
+import warnings
 import numpy as np
+import scipy.fft
+import scipy.linalg
+import scipy.signal
 import xarray as xr
 
+from .fit_prony import prony_fit_kernel
+from .trajectories_handler import Trajectory_writer
+
 
 def ft(f, t):
     w = 2.0 * np.pi * np.fft.fftfreq(len(f)) / (t[1] - t[0])
@@ -16,6 +23,83 @@ def ift(f, w, t):
     return g
 
 
+def _array_blocks(arr):
+    """
+    Return a function that give the successive blocks of arr along the first axis.
+    """
+    start = 0
+
+    def next_block(size):
+        nonlocal start
+        start += size
+        return arr[start - size : start]
+
+    return next_block
+
+
+class NoiseStream:
+    """
+    Colored noise drawn by blocks, using FFT overlap-add of white noise with a filter.
+    The state is kept between calls such that successive calls give a single stationary noise of arbitrary length,
+    at cost O(log L) per step and constant memory.
+    """
+
+    def __init__(self, filter, dt, n_traj=1, rng=np.random.normal, block_size=None):
+        """
+        Parameters
+        ----------
+        filter : array (L, dim_in, dim)
+            Filter h such that noise[n] = sum_j white[n-j] @ h[j] * sqrt(dt).
+        n_traj : int, default=1
+            Number of independent noises generated at once.
+        block_size : int, default=None
+            Number of white noise steps per transform.
+        """
+        self.dt = dt
+        self.rng = rng
+        self.n_traj = n_traj
+        self.len_filter, self.dim_in, self.dim = filter.shape
+        if block_size is None:
+            block_size = max(4 * self.len_filter, 1024)
+        self.n_fft = scipy.fft.next_fast_len(block_size + self.len_filter - 1, real=True)
+        self.block_size = self.n_fft - self.len_filter + 1  # Use all the available length
+        self.filter_hat = scipy.fft.rfft(filter, n=self.n_fft, axis=0)
+        self.reset()
+
+    def reset(self):
+        """
+        Start a new independent noise
+        """
+        self._carry = np.zeros((self.len_filter - 1, self.n_traj, self.dim))
+        self._pending = np.zeros((0, self.n_traj, self.dim))
+        self._skip = self.len_filter - 1  # First values does not see the full filter
+
+    def _next_block(self):
+        white_noise = self.rng(size=(self.block_size, self.n_traj, self.dim_in))
+        colored_noise = scipy.fft.irfft(np.einsum("fte,fed->ftd", scipy.fft.rfft(white_noise, n=self.n_fft, axis=0), self.filter_hat), n=self.n_fft, axis=0)
+        colored_noise[: self.len_filter - 1] += self._carry
+        self._carry = colored_noise[self.block_size :].copy()
+        return colored_noise[: self.block_size]
+
+    def __call__(self, size):
+        """
+        Return the noise for the next size steps as an array (size, n_traj, dim)
+        """
+        blocks = [self._pending]
+        n_avail = self._pending.shape[0]
+        while n_avail < size:
+            block = self._next_block()
+            if self._skip > 0:
+                n_skip = min(self._skip, block.shape[0])
+                block = block[n_skip:]
+                self._skip -= n_skip
+            blocks.append(block)
+            n_avail += block.shape[0]
+        noise = np.concatenate(blocks, axis=0)
+        self._pending = noise[size:]
+        return noise[:size] * np.sqrt(self.dt)
+
+
 class ColoredNoiseGenerator:
     """
     A class for the generation of colored noise.
@@ -62,6 +146,72 @@ class ColoredNoiseGenerator:
             colored_noise[:, d] = np.convolve(white_noise, self.sqk[:, d, d], mode="same")
         return colored_noise[:size] * np.sqrt(self.dt)
 
+    def generate_ensemble(self, size, n_traj):
+        """
+        Generate independent noises for n_traj trajectories at once, return an array (size, n_traj, dim).
+        Each trajectory follows the same law than generate.
+        """
+        colored_noise = np.empty((size, n_traj, self.dim))
+        start = (min(size, self.sqk.shape[0]) - 1) // 2  # Same centering than np.convolve(mode="same")
+        for d in range(self.dim):
+            white_noise = self.rng(size=(size, n_traj))
+            colored_noise[:, :, d] = scipy.signal.fftconvolve(white_noise, self.sqk[:, d, d, np.newaxis], mode="full", axes=0)[start : start + size]
+        return colored_noise * np.sqrt(self.dt)
+
+    def stream(self, n_traj=1, block_size=None):
+        """
+        Return a NoiseStream with the same correlation than generate, to draw the noise lazily by blocks.
+        """
+        return NoiseStream(np.einsum("jdd->jd", self.sqk[:, : self.dim, :])[:, np.newaxis, :] * np.eye(self.dim)[np.newaxis], self.dt, n_traj=n_traj, rng=self.rng, block_size=block_size)
+
+
+class MatrixColoredNoiseGenerator:
+    """
+    A class for the generation of colored vector noise with a matrix-valued correlation function.
+    The spectral density is factorized once per frequency and the noise is generated by FFT blocks.
+    """
+
+    def __init__(self, kernel, t, rng=np.random.normal):
+        """
+        Create an instance of the MatrixColoredNoiseGenerator class.
+
+        Parameters
+        ----------
+        kernel : numpy.array (len_kernel, dim, dim)
+            The correlation function of the noise, kernel[n] = <noise(t+n dt) noise(t)^T>.
+        t : numpy.array
+            The time values of kernel.
+        """
+        self.t = t.ravel()
+        self.dt = self.t[1] - self.t[0]
+        self.kernel = kernel
+        self.dim = kernel.shape[-1]
+        self.rng = rng
+        if kernel.shape[1] != self.dim:
+            raise ValueError("The noise kernel should be a square matrix.")
+        len_kernel = kernel.shape[0]
+        # Circular extension of the kernel, using kernel(-t) = kernel(t)^T
+        kernel_circ = np.concatenate((kernel, np.transpose(kernel[:0:-1], (0, 2, 1))), axis=0)
+        spectral_density = np.fft.fft(kernel_circ, axis=0)
+        spectral_density = 0.5 * (spectral_density + np.conj(np.transpose(spectral_density, (0, 2, 1))))  # Remove numerical non hermitian part
+        eigvals, eigvect = np.linalg.eigh(spectral_density)
+        self.spectral_factor = np.einsum("fij,fj,fkj->fik", eigvect, np.sqrt(np.clip(eigvals, 0.0, None)), np.conj(eigvect))
+        # Factor in time such that noise[n] = sum_j filter[j] @ white[n-j], centered at len_kernel-1
+        factor = np.roll(np.fft.ifft(self.spectral_factor, axis=0).real, len_kernel - 1, axis=0)
+        self.filter = np.transpose(factor, (0, 2, 1))  # As (L, dim_in, dim) for NoiseStream
+
+    def stream(self, n_traj=1, block_size=None):
+        """
+        Return a NoiseStream to draw the noise lazily by blocks.
+        """
+        return NoiseStream(self.filter / np.sqrt(self.dt), self.dt, n_traj=n_traj, rng=self.rng, block_size=block_size)
+
+    def generate(self, size):
+        return self.stream(1)(size)[:, 0, :]
+
+    def generate_ensemble(self, size, n_traj):
+        return self.stream(n_traj)(size)
+
 
 class KarhunenLoeveNoiseGenerator:
     """
@@ -86,33 +236,88 @@ class KarhunenLoeveNoiseGenerator:
             cov_mat[:, n] = kernel_sym[N_size - n - 1 : -n]
         return cov_mat
 
-    def __init__(self, kernel, dt, rng=np.random.normal):
+    def __init__(self, kernel, dt, rng=np.random.normal, stationary=False):
         """
         Create an instance of the KarhunenLoeveNoiseGenerator class.
 
         Parameters
         ----------
         kernel : numpy.array
-            The correlation function of the noise.
+            The covariance matrix of the noise or, if stationary, the correlation function of the noise.
         t : numpy.array
             The time values of kernel.
+        stationary : bool, default=False
+            Use circulant embedding of the correlation function instead of the decomposition of the covariance matrix.
+            The correlation is taken as zero after the end of kernel and noise of any length can be generated.
         """
         self.dt = dt
 
         self.rng = rng
         self.kernel = kernel
+        self.stationary = stationary
 
-        self.lenght = np.min(kernel.shape)
+        if self.stationary:
+            self.kernel = np.asarray(kernel).ravel()
+            self.lenght = self.kernel.shape[0]
+            self._embeddings = {}
+        else:
+            self.lenght = np.min(kernel.shape)
+            self.eigvals, self.eigvect = np.linalg.eig(self.kernel)
 
-        self.eigvals, self.eigvect = np.linalg.eig(self.kernel)
+    def _circulant_eigvals(self, size):
+        """
+        Eigenvalues of a circulant matrix that contains the covariance matrix of size points.
+        The embedding is enlarged until it is positive, when it is not possible negative eigenvalues are set to zero.
+        """
+        if size not in self._embeddings:
+            corr = np.zeros(max(size, self.lenght, 2))
+            corr[: self.lenght] = self.kernel
+            while True:
+                eigvals = np.fft.fft(np.concatenate((corr, corr[-2:0:-1]))).real
+                if eigvals.min() >= -1e-10 * eigvals.max() or corr.shape[0] > 8 * max(size, self.lenght):
+                    break
+                corr = np.concatenate((corr, np.zeros(corr.shape[0])))
+            if eigvals.min() < -1e-10 * eigvals.max():
+                warnings.warn("Circulant embedding of the kernel is not positive, the covariance of the noise will not be exact.")
+            self._embeddings[size] = np.clip(eigvals, 0.0, None)
+        return self._embeddings[size]
+
+    def _generate_stationary(self, size):
+        eigvals = self._circulant_eigvals(size)
+        white_noise = self.rng(size=eigvals.shape[0]) + 1j * self.rng(size=eigvals.shape[0])
+        colored_noise = np.fft.fft(np.sqrt(eigvals / eigvals.shape[0]) * white_noise).real
+        return colored_noise[:size] * np.sqrt(self.dt)
+
+    def stream(self, n_traj=1, block_size=None):
+        """
+        Return a NoiseStream to draw stationary noise of arbitrary length by blocks.
+        It uses the minimum phase factor of the correlation function, such that the covariance of successive blocks is exact
+        when the spectral density of the correlation function is positive. Otherwise, negative values are clipped and a warning is issued.
+        """
+        if not self.stationary:
+            raise ValueError("Streaming is only available for stationary noise.")
+        n_fft = 2 ** int(np.ceil(np.log2(64 * self.lenght)))
+        corr = np.zeros(n_fft)
+        corr[: self.lenght] = self.kernel
+        corr[n_fft - self.lenght + 1 :] = self.kernel[:0:-1]
+        spectral_density = np.fft.fft(corr).real
+        if spectral_density.min() < -1e-10 * spectral_density.max():
+            warnings.warn("Spectral density of the kernel is not positive, the covariance of the noise will not be exact.")
+        spectral_density = np.clip(spectral_density, 1e-14 * spectral_density.max(), None)
+        # Minimum phase factor from the cepstrum
+        cepstrum = np.fft.ifft(0.5 * np.log(spectral_density)).real
+        cepstrum[1 : n_fft // 2] *= 2.0
+        cepstrum[n_fft // 2 + 1 :] = 0.0
+        factor = np.fft.ifft(np.exp(np.fft.fft(cepstrum))).real[: self.lenght]
+        return NoiseStream(factor[:, np.newaxis, np.newaxis], self.dt, n_traj=n_traj, rng=self.rng, block_size=block_size)
 
     def generate(self, size=None):
         if size is None:
             size = self.lenght
+        if self.stationary:
+            return self._generate_stationary(size)
         if size > self.lenght:
-            raise ValueError("Cannot generate noise for longuer time than the one in the kernel\n Use stationary or periodic assumption to go further")
-            # TODO: Use stationary assumption that kernel does not evolve anymore to generate more noise
-            # TODO: Use periodic assumption
+            raise ValueError("Cannot generate noise for longer time than the one in the kernel.\nUse stationary=True or stream() to generate noise of arbitrary length.")
         white_noise = self.rng(size=self.lenght)
         colored_noise = self.eigvect @ np.diag(np.sqrt(self.eigvals)) @ white_noise
         return colored_noise[:size] * np.sqrt(self.dt)
@@ -169,7 +374,6 @@ class PosColoredNoiseGenerator:
         """
         Mais c'est super lourd
         """
-        sqk_ft = np.sqrt(self.kernel_ft)
         colored_noise = np.empty((max(ind, self.sqk.shape[0]), self.dim))
         sqk_ft = np.sqrt(np.einsum("kl,ikd->idl", E_noise, self.kernel_ft))  # If self.dim > 1, we should use the cholesky instead of the square root
         for d in range(self.dim):
@@ -223,7 +427,10 @@ class Integrator_gle(object):
 
         self.trunc_kernel = self.kernel.shape[0]
 
-        self.noise_generator = ColoredNoiseGenerator(kernel_noise, gle_model.kernel["time_kernel"].to_numpy(), rng=rng)
+        if kernel_noise.ndim == 3 and kernel_noise.shape[1] == kernel_noise.shape[2]:
+            self.noise_generator = MatrixColoredNoiseGenerator(kernel_noise, np.arange(kernel_noise.shape[0]) * self.dt, rng=rng)
+        else:
+            self.noise_generator = ColoredNoiseGenerator(kernel_noise, gle_model.kernel["time_kernel"].to_numpy(), rng=rng)
 
     def _copy_from_estimator(self, gle_model, trunc_kernel=None):
         """
@@ -267,10 +474,19 @@ class Integrator_gle(object):
             E = np.einsum("kj,ij->ik", self.P_range, E)
         return bk, E, dbk
 
-    def _mem_int_red(self, E):
+    def _mem_reset(self):
+        """
+        Called at the start of each run, for integrators that keep a state of the memory.
+        """
+        pass
+
+    def _mem_int_red(self, E, n_start=0):
+        """
+        History part of the memory integral. E holds the last values of the basis, n_start is the index of E[0] in the whole trajectory.
+        """
         loc_trunc = min(E.shape[0], self.trunc_kernel - 1)
         start_trunc = max(E.shape[0] - loc_trunc, 0)
-        return np.einsum("ik,ikl->l", E[start_trunc + 1 :][::-1, :], self.kernel[1:loc_trunc]) * self.dt + 0.5 * self.dt * E[start_trunc] @ self.kernel[loc_trunc]
+        return np.einsum("i...k,ikl->...l", E[start_trunc + 1 :][::-1], self.kernel[1:loc_trunc]) * self.dt + 0.5 * self.dt * E[start_trunc] @ self.kernel[loc_trunc]
 
     def _f_rk(self, x, v, rmi, fr, alpha, last_E, last_rmi):
         """
@@ -288,48 +504,234 @@ class Integrator_gle(object):
         a = (k1v + 2.0 * k2v + 2.0 * k3v + k4v) / 6.0
         return x + self.dt * (k1x + 2.0 * k2x + 2.0 * k3x + k4x) / 6.0, v + self.dt * a, a
 
-    def run(self, n_steps, x0=None, set_noise_to_zero=False):
+    def _integrate(self, n_steps, noise, x_init, v_init, sink, save_every=1, chunk_size=None, variables=("x", "v")):
         """
-        Run a trajectory of length n_steps with initial conditions x0.
+        Integrate all trajectories at once on numpy buffers.
+
+        The values of the basis are stored in a buffer that holds only the part of the history needed by the memory integral.
+        The trajectory is stored every save_every steps and sent to sink by chunks of chunk_size stored steps,
+        such that the memory used does not depend on n_steps.
+
+        Parameters
+        ----------
+        noise : callable
+            noise(size) return the noise for the next size steps as an array (size, n_traj, dim).
+        x_init, v_init : array (n_0, n_traj, dim)
+            Initial conditions
+        sink : callable
+            sink(start, arrays) is called with the index of the first stored step of the chunk and a dict of arrays (n, n_traj, dim).
+        variables : list of str
+            Stored variables, among "x", "v", "noise" and "memory" (history part of the memory integral).
+        """
+        n_traj, n_0 = x_init.shape[1], x_init.shape[0]
+        n_out = (n_steps - 1) // save_every + 1
+        if chunk_size is None:
+            chunk_size = n_out
+        chunk = {name: np.zeros((min(chunk_size, n_out), n_traj, self.dim)) for name in variables}
+        n_chunk, n_stored = 0, 0
+        block_size = chunk_size * save_every  # Number of steps of noise drawn at once
+
+        # History buffer, the last n_keep values are moved to the start when it is full
+        n_keep = max(self.trunc_kernel, n_0)
+        E = np.zeros((n_keep + max(n_keep, 256), n_traj, self.kernel.shape[1]))
+        n_start = 0  # Index of E[0] in the trajectory
+        rmi = np.zeros((n_traj, self.dim))
+        self._mem_reset()
+        for ind in range(n_steps):
+            if ind % block_size == 0:
+                noise_block = noise(min(block_size, n_steps - ind))
+            pos = ind - n_start
+            if pos == E.shape[0]:
+                E[:n_keep] = E[pos - n_keep : pos]
+                n_start += pos - n_keep
+                pos = n_keep
+            if ind < n_0:  # Initial conditions
+                x, v = x_init[ind], v_init[ind]
+                if ind == n_0 - 1 and n_0 > 1:
+                    rmi = self._mem_int_red(E[: n_0 - 1])
+            else:
+                last_rmi = rmi
+                last_E = E[pos - 1]
+                rmi = self._mem_int_red(E[:pos], n_start)
+                x, v, a = self._rk_step(x, v, rmi, noise_block[ind % block_size], last_E, last_rmi)
+            _, E[pos], _ = self.basis_vector(x, v)
+            if ind % save_every == 0:
+                values = {"x": x, "v": v, "noise": noise_block[ind % block_size], "memory": rmi}
+                for name in variables:
+                    chunk[name][n_chunk] = values[name]
+                n_chunk += 1
+                if n_chunk == chunk_size or n_stored + n_chunk == n_out:
+                    sink(n_stored, {name: val[:n_chunk] for name, val in chunk.items()})
+                    n_stored += n_chunk
+                    n_chunk = 0
+
+    def _run(self, n_steps, noise, x_init, v_init, dims, save_every=1, output=None, chunk_size=None, save_noise=False, save_memory=False):
+        """
+        Run the integration and store the trajectories in memory or in the output file.
+        """
+        variables = ["x", "v"] + (["noise"] if save_noise else []) + (["memory"] if save_memory else [])
+        n_0 = x_init.shape[0]
+        time = (n_0 - 1 + np.arange(0, n_steps, save_every)) * self.dt
+        squeeze = "traj" not in dims
+        attrs = {"dt": self.dt * save_every}
+        if output is None:
+            res = {name: np.zeros((time.shape[0],) + x_init.shape[1:]) for name in variables}
+
+            def sink(start, arrays):
+                for name, val in arrays.items():
+                    res[name][start : start + val.shape[0]] = val
+
+            self._integrate(n_steps, noise, x_init, v_init, sink, save_every=save_every, chunk_size=chunk_size, variables=variables)
+            return xr.Dataset({name: (dims, val[:, 0, :] if squeeze else val) for name, val in res.items()}, coords={"time": time}, attrs=attrs)
+
+        if chunk_size is None:
+            chunk_size = 10000
+        writer = Trajectory_writer(output, {d: x_init.shape[1] if d == "traj" else self.dim for d in dims[1:]}, variables=variables, attrs=attrs)
+        try:
+
+            def sink(start, arrays):
+                writer.append(time[start : start + len(arrays["x"])], **{name: val[:, 0, :] if squeeze else val for name, val in arrays.items()})
+
+            self._integrate(n_steps, noise, x_init, v_init, sink, save_every=save_every, chunk_size=chunk_size, variables=variables)
+        finally:
+            writer.close()
+        return writer.open()
+
+    def _noise_source(self, n_steps, n_traj, set_noise_to_zero=False):
+        """
+        Return a function that give the noise for the next steps, drawn lazily by blocks when the generator allows it.
         """
         if set_noise_to_zero:
-            noise = np.zeros((n_steps, self.dim))
-        else:
-            noise = self.noise_generator.generate(n_steps)
+            return lambda size: np.zeros((size, n_traj, self.dim))
+        if hasattr(self.noise_generator, "stream"):
+            return self.noise_generator.stream(n_traj)
+        if n_traj == 1:
+            return _array_blocks(self.noise_generator.generate(n_steps)[:, np.newaxis, :])
+        return _array_blocks(self.noise_generator.generate_ensemble(n_steps, n_traj))
+
+    def _initial_arrays(self, x0, n_traj):
+        """
+        Convert initial conditions into arrays (n_0, n_traj, dim)
+        """
+        if x0 is None:
+            return np.zeros((1, n_traj, self.dim)), np.zeros((1, n_traj, self.dim))
+        if isinstance(x0, xr.Dataset):
+            x0 = [x0] * n_traj
+        if len(x0) != n_traj:
+            raise ValueError("Number of initial conditions does not match the number of trajectories.")
+        n_0 = x0[0]["time"].shape[0]
+        x_init = np.stack([np.asarray(start["x"]).reshape(n_0, self.dim) for start in x0], axis=1)
+        v_init = np.stack([np.asarray(start["v"]).reshape(n_0, self.dim) for start in x0], axis=1)
+        return x_init, v_init
+
+    def run(self, n_steps, x0=None, set_noise_to_zero=False, save_every=1, output=None, chunk_size=None, save_noise=False, save_memory=False):
+        """
+        Run a trajectory of length n_steps with initial conditions x0.
 
-        trj = xr.Dataset({"x": (["time", "dim_x"], np.zeros((n_steps, self.dim))), "v": (["time", "dim_x"], np.zeros((n_steps, self.dim)))}, coords={"time": np.arange(n_steps) * self.dt}, attrs={"dt": self.dt})
+        Parameters
+        ----------
+        save_every : int, default=1
+            Store the trajectory only every save_every steps.
+        output : str, default=None
+            If given, the trajectory is written by chunks into this NetCDF or Zarr file (Zarr if the name ends with .zarr)
+            instead of being kept in memory. The file is then returned as a lazy dataset.
+        chunk_size : int, default=None
+            Number of stored steps per chunk. Default to 10000 when writing to output.
+        save_noise, save_memory : bool, default=False
+            Store also the noise and the history part of the memory integral.
+        """
+        x_init, v_init = self._initial_arrays(x0, 1)
+        return self._run(n_steps, self._noise_source(n_steps, 1, set_noise_to_zero), x_init, v_init, ["time", "dim_x"], save_every=save_every, output=output, chunk_size=chunk_size, save_noise=save_noise, save_memory=save_memory)
 
-        if x0 is not None:
-            n_0 = x0["time"].shape[0]
-            # Slicing the DataSet and setting its n_0 first value with
-            trj["x"][:n_0] = x0["x"]
-            trj["v"][:n_0] = x0["v"]
-        else:
-            n_0 = 1
-        trj["time"] = (n_0 - 1 + np.arange(n_steps)) * self.dt
-
-        E = np.zeros((n_steps, self.kernel.shape[1]))
-        rmi = np.zeros(self.dim)
-        for ind in range(n_0):  # If needed to initialize
-            _, E_step, _ = self.basis_vector(trj["x"].isel(time=[ind]), trj["v"].isel(time=[ind]))
-            E[ind, :] = E_step[0, :]
-        if n_0 > 1:
-            rmi = self._mem_int_red(E[: n_0 - 1])
-        x = trj["x"].isel(time=[n_0 - 1]).data
-        v = trj["v"].isel(time=[n_0 - 1]).data
-        for ind in range(n_0, n_steps):
-            # print("----------------", ind, "----------")
-            last_rmi = rmi
-            last_E = E[ind - 1]
-            rmi = self._mem_int_red(E[:ind])
-            x, v, a = self._rk_step(x, v, rmi, noise[ind, :], last_E, last_rmi)
-            trj["x"][ind] = x[0, :]  # A changer en utilisant loc
-            trj["v"][ind] = v[0, :]
+    def run_ensemble(self, n_traj, n_steps, x0=None, set_noise_to_zero=False, save_every=1, output=None, chunk_size=None, save_noise=False, save_memory=False):
+        """
+        Run n_traj independent trajectories of length n_steps at once.
+        All trajectories are advanced together such that basis evaluations, memory integrals and noise generation are vectorized.
 
-            _, E_step, _ = self.basis_vector(x, v)
-            E[ind, :] = E_step[0, :]
+        Parameters
+        ----------
+        n_traj : int
+            Number of trajectories
+        n_steps : int
+            Length of the trajectories
+        x0 : xarray.Dataset or list of xarray.Dataset, default=None
+            Initial conditions, either common to all trajectories or one per trajectory (with the same length).
+        set_noise_to_zero : bool, default=False
+        save_every, output, chunk_size, save_noise, save_memory:
+            Same as run.
+
+        Returns
+        -------
+        trj : xarray.Dataset
+            Trajectories with dimensions (time, traj, dim_x). trj.isel(traj=n) is a trajectory as returned by run.
+        """
+        x_init, v_init = self._initial_arrays(x0, n_traj)
+        return self._run(n_steps, self._noise_source(n_steps, n_traj, set_noise_to_zero), x_init, v_init, ["time", "traj", "dim_x"], save_every=save_every, output=output, chunk_size=chunk_size, save_noise=save_noise, save_memory=save_memory)
 
-        return trj
+
+class Integrator_gle_prony(Integrator_gle):
+    """
+    Integrator where each component of the kernel is represented by a Prony series, K(t) = y0 * expm(t A)[0, 0].
+    The memory integral is then propagated with auxiliary variables (Markovian embedding),
+    with a cost per step that does not depend on the length of the kernel.
+    """
+
+    def __init__(self, gle_model, prony_coeffs=None, thres=None, N_keep=None, **kwargs):
+        """
+        Parameters
+        ----------
+        prony_coeffs : list, default=None
+            Output of prony_fit_kernel. If None, the kernel of the model is fitted.
+        thres, N_keep:
+            Parameters of prony_fit_kernel, used when prony_coeffs is None.
+        Other parameters are the same than Integrator_gle.
+        """
+        Integrator_gle.__init__(self, gle_model, **kwargs)
+        if prony_coeffs is None:
+            time_kernel = np.arange(self.kernel.shape[0]) * self.dt
+            prony_coeffs = prony_fit_kernel(time_kernel, self.kernel, thres=thres, N_keep=N_keep)
+        self.prony_coeffs = prony_coeffs
+        self._set_embedding(prony_coeffs)
+
+    def _set_embedding(self, prony_coeffs):
+        """
+        Build the auxiliary variables dynamics from the Prony series.
+        The block diagonal matrix of all series is diagonalized such that each step is an elementwise product.
+        """
+        dim_x = len(prony_coeffs)
+        dim_basis = len(prony_coeffs[0])
+        blocks, inject, read = [], [], []
+        for d in range(dim_x):
+            for k in range(dim_basis):
+                y0, A = prony_coeffs[d][k]
+                A = np.atleast_2d(A)
+                blocks.append(A)
+                e0 = np.zeros(A.shape[0])
+                e0[0] = 1.0
+                inject.append(np.outer(e0, np.eye(dim_basis)[k]))
+                read.append(y0 * np.outer(np.eye(dim_x)[d], e0))
+        A_full = scipy.linalg.block_diag(*blocks)
+        lamb, vect = np.linalg.eig(A_full)
+        inv_vect = np.linalg.inv(vect)
+        self._prony_decay = np.exp(self.dt * lamb)
+        self._prony_inject = self.dt * inv_vect @ np.concatenate(inject, axis=0)  # (n_exp, dim_basis)
+        self._prony_read = np.concatenate(read, axis=1) @ vect  # (dim_x, n_exp)
+        self._mem_reset()
+
+    def _mem_reset(self):
+        self._prony_state = np.zeros(self._prony_decay.shape[0], dtype=complex)
+        self._prony_n = 0
+
+    def _mem_int_red(self, E, n_start=0):
+        """
+        Update the auxiliary variables with the new values of E and return the history part of the memory.
+        Give the same trapezoidal rule than Integrator_gle for an untruncated exponential kernel.
+        """
+        for n in range(self._prony_n - n_start, E.shape[0]):
+            weight = 0.5 if n + n_start == 0 else 1.0
+            self._prony_state = self._prony_decay * (self._prony_state + weight * (E[n] @ self._prony_inject.T))
+        self._prony_n = n_start + E.shape[0]
+        return np.real(self._prony_state @ self._prony_read.T)
 
 
 class Integrator_gle_const_kernel(Integrator_gle):
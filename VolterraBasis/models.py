@@ -1,12 +1,15 @@
 import numpy as np
 import xarray as xr
 import warnings
+import scipy.sparse
 from scipy.integrate import simpson
 from .basis import describe_from_dim
+from .basis_cache import BasisCache, cached_basis_vector
 
 from .fkernel import memory_rect, memory_trapz, corrs_rect, corrs_trapz
 from .fkernel import rect_integral, trapz_integral, simpson_integral
 from .fkernel import solve_ide_rect, solve_ide_trapz, solve_ide_trapz_stab
+from .volterra_fft import memory_fft, corrs_fft
 
 
 def _convert_input_array_for_evaluation(array, dim_x):
@@ -28,6 +31,17 @@ def matmulPrange(P_range, E):
     return xr.dot(E.rename({"dim_basis": "dim_basis_old"}), P_range)
 
 
+def _sparse_contract(S, *vectors):
+    """
+    Contract the dimensions after the basis one of a sparse.COO array (time, dim_basis, dim_x, ...) with arrays (time, dim_x).
+    Return a scipy.sparse matrix (time, dim_basis).
+    """
+    data = S.data.copy()
+    for n, vect in enumerate(vectors):
+        data *= vect[S.coords[0], S.coords[2 + n]]
+    return scipy.sparse.csr_matrix((data, (S.coords[0], S.coords[1])), shape=S.shape[:2])
+
+
 class ModelBase(object):
     """
     The base class for holding the model
@@ -75,6 +89,26 @@ class ModelBase(object):
         self.rank_projection = False
         self.P_range = None
 
+        self.basis_cache = None
+
+    def set_basis_cache(self, maxsize=32, location=None):
+        """
+        Cache evaluations of the basis, such that repeated analysis of the same trajectories skip them.
+        Cached values are keyed on the trajectory content and the fitted basis.
+
+        Parameters
+        ----------
+        maxsize : int, default=32
+            Maximum number of evaluations kept in memory. If 0, disable the cache.
+        location : str, default=None
+            Directory where evaluations are also stored.
+        """
+        if maxsize <= 0 and location is None:
+            self.basis_cache = None
+        else:
+            self.basis_cache = BasisCache(maxsize=maxsize, location=location)
+        return self.basis_cache
+
     def _check_basis(self, basis, describe_data=None):
         """
         Simple checks on the basis class
@@ -132,10 +166,33 @@ class ModelBase(object):
         "kernel": for the evaluation of the kernel.
 
         "corrs": for the computation of the correlation function.
+
+        "fused": the values of "corrs" followed by the ones of "kernel", from a single evaluation of the basis.
         """
         raise NotImplementedError
 
-    def compute_noise(self, xva, trunc_kernel=None, start_point=0, end_point=None):
+    def basis_vector_fused(self, xva):
+        """
+        Basis values for the mean force, the correlations and the gram matrix of the kernel, from a single evaluation of the basis.
+        Return (E_force, E, dE, E_kernel). When the basis cache is set, values are also stored as the "force", "corrs" and "kernel" evaluations,
+        such that later calls of basis_vector on the same trajectory reuse them.
+        """
+        value = self.basis_vector(xva, compute_for="fused")
+        if self.basis_cache is not None and isinstance(xva, xr.Dataset):
+            for compute_for, val in [("force", value[0]), ("corrs", tuple(value[:3])), ("kernel", value[3])]:
+                key = self.basis_cache.key(self, xva, compute_for)
+                if key not in self.basis_cache:
+                    self.basis_cache.set(key, val)
+        return value
+
+    def basis_vector_sparse(self, xva, compute_for="corrs"):
+        """
+        Same as basis_vector but return sparse arrays with time as first dimension.
+        Available for bases that implement basis_sparse() and deriv_sparse().
+        """
+        raise NotImplementedError("Sparse evaluation is not available for this model.")
+
+    def compute_noise(self, xva, trunc_kernel=None, start_point=0, end_point=None, conv_method="direct"):
         """
         From a trajectory get the noise.
 
@@ -147,6 +204,9 @@ class ModelBase(object):
         trunc_kernel : int
                 Number of datapoint of the kernel to consider.
                 Can be used to remove unphysical divergence of the kernel or shortten execution time.
+        conv_method : {"direct", "fft"}, default="direct"
+                Algorithm for the memory integral. "fft" use blockwise FFT convolution with the same quadrature,
+                that is much faster for long trajectories and kernels.
         """
         if self.force_coeff is None:
             raise Exception("Mean force has not been computed.")
@@ -160,15 +220,23 @@ class ModelBase(object):
         if self.rank_projection:
             E = matmulPrange(self.P_range, E)
         force = xr.dot(E_force, self.force_coeff, dims=["dim_basis", "dim_x"])
-        if self.method in ["rect", "rectangular", "second_kind_rect"] or self.method is None:
-            memory = memory_rect(self.kernel[:trunc_kernel], E, dt)
-        elif self.method == "trapz" or self.method == "second_kind_trapz":
-            memory = memory_trapz(self.kernel[:trunc_kernel], E, dt)
+        if conv_method not in ["direct", "fft"]:
+            raise ValueError("Unknown convolution method {}".format(conv_method))
+        if self.method in ["rect", "rectangular", "second_kind_rect", "rect_fft", "rectangular_fft", "second_kind_rect_fft"] or self.method is None:
+            if conv_method == "fft":
+                memory = memory_fft(self.kernel[:trunc_kernel], E, dt, method="rect")
+            else:
+                memory = memory_rect(self.kernel[:trunc_kernel], E, dt)
+        elif self.method in ["trapz", "second_kind_trapz", "trapz_fft", "second_kind_trapz_fft"]:
+            if conv_method == "fft":
+                memory = memory_fft(self.kernel[:trunc_kernel], E, dt, method="trapz")
+            else:
+                memory = memory_trapz(self.kernel[:trunc_kernel], E, dt)
         else:
             raise ValueError("Cannot compute noise when kernel computed with method {}".format(self.method))
         return time, xva[self.L_obs] - force - memory, xva[self.L_obs], force, memory
 
-    def compute_corrs_w_noise(self, xva, left_op=None):
+    def compute_corrs_w_noise(self, xva, left_op=None, conv_method="direct"):
         """
         Compute correlation between noise and left_op
 
@@ -177,6 +245,9 @@ class ModelBase(object):
         xva : xarray dataset (['time', 'x', 'v', 'a']) .
             Use compute_va() or see its output for format details.
             Input trajectory to compute noise.
+        conv_method : {"direct", "fft"}, default="direct"
+            If "fft", obtain the result from FFT correlations of left_op with the noise and the basis,
+            the trajectory should be longer than twice the kernel.
         """
         if self.force_coeff is None:
             raise Exception("Mean force has not been computed.")
@@ -199,9 +270,15 @@ class ModelBase(object):
         elif isinstance(left_op, np.ndarray) or isinstance(left_op, xr.DataArray):
             left_op_dat = left_op
 
-        if self.method in ["rect", "rectangular", "second_kind_rect"] or self.method is None:
+        if conv_method not in ["direct", "fft"]:
+            raise ValueError("Unknown convolution method {}".format(conv_method))
+        if self.method in ["rect", "rectangular", "second_kind_rect", "rect_fft", "rectangular_fft", "second_kind_rect_fft"] or self.method is None:
+            if conv_method == "fft":
+                return self.kernel["time_kernel"], corrs_fft(noise, self.kernel, E, left_op_dat, dt, method="rect")
             return self.kernel["time_kernel"], corrs_rect(noise, self.kernel, E, left_op_dat, dt)
-        elif self.method == "trapz" or self.method == "second_kind_trapz":
+        elif self.method in ["trapz", "second_kind_trapz", "trapz_fft", "second_kind_trapz_fft"]:
+            if conv_method == "fft":
+                return self.kernel["time_kernel"][:-1], corrs_fft(noise, self.kernel, E, left_op_dat, dt, method="trapz")
             return self.kernel["time_kernel"][:-1], corrs_trapz(noise, self.kernel, E, left_op_dat, dt)
         else:
             raise ValueError("Cannot compute noise when kernel computed with method {}".format(self.method))
@@ -373,7 +450,7 @@ class ModelBase(object):
         if self.gram_force is not None:
             coeffs.update({"gram_force": self.gram_force.rename({"dim_basis": "dim_basis_force", "dim_basis'": "dim_basis_force'"})})
         for key, dat in self.__dict__.items():
-            if key not in coeffs.attrs and key not in ["basis", "force_coeff", "gram_force", "N_basis_elt_force", "N_basis_elt_kernel"]:  # Eclude some vaiable
+            if key not in coeffs.attrs and key not in ["basis", "basis_cache", "force_coeff", "gram_force", "N_basis_elt_force", "N_basis_elt_kernel"]:  # Eclude some vaiable
                 if dat is not None:
                     coeffs.update({key: dat})
 
@@ -441,6 +518,7 @@ class Pos_gle(ModelBase):
         self.N_basis_elt_kernel = self.N_basis_elt - int(self.basis.const_removed) * self.dim_x
         self.rank_projection = not self.basis.const_removed
 
+    @cached_basis_vector
     def basis_vector(self, xva, compute_for="corrs"):
 
         bk = xr.apply_ufunc(self.basis.basis, xva["x"], input_core_dims=[["dim_x"]], output_core_dims=[["dim_basis"]], exclude_dims={"dim_x"}, dask_gufunc_kwargs={"output_sizes": {"dim_basis": self.N_basis_elt}}, dask="parallelized")
@@ -451,10 +529,33 @@ class Pos_gle(ModelBase):
         dbk = xr.apply_ufunc(self.basis.deriv, xva["x"], input_core_dims=[["dim_x"]], output_core_dims=[["dim_basis", "dim_x"]], dask_gufunc_kwargs={"output_sizes": {"dim_basis": self.N_basis_elt_kernel, "dim_x": self.dim_x}}, dask="parallelized")
         if compute_for == "kernel":  # For kernel evaluation
             return dbk
-        elif compute_for == "corrs":
+        elif compute_for in ["corrs", "fused"]:
             ddbk = xr.apply_ufunc(self.basis.hessian, xva["x"], input_core_dims=[["dim_x"]], output_core_dims=[["dim_basis", "dim_x", "dim_x'"]], dask_gufunc_kwargs={"output_sizes": {"dim_basis": self.N_basis_elt_kernel, "dim_x": self.dim_x, "dim_x'": self.dim_x}}, dask="parallelized")
             E = xr.dot(dbk, xva["v"], dims=["dim_x"])
             dE = xr.dot(dbk, xva["a"], dims=["dim_x"]) + xr.dot(ddbk, xva["v"], xva["v"].rename({"dim_x": "dim_x'"}), dims=["dim_x", "dim_x'"])
+            if compute_for == "fused":
+                return bk, E, dE, dbk
+            return bk, E, dE
+        else:
+            raise ValueError("Basis evaluation goal not specified")
+
+    def basis_vector_sparse(self, xva, compute_for="corrs"):
+        if not callable(getattr(self.basis, "basis_sparse", None)):
+            raise NotImplementedError("Basis does not implement basis_sparse().")
+        x = np.asarray(xva["x"])
+        bk = self.basis.basis_sparse(x)
+        if compute_for == "force":
+            return bk
+        dbk = self.basis.deriv_sparse(x)
+        if compute_for == "kernel":
+            return dbk
+        elif compute_for == "corrs":
+            if not callable(getattr(self.basis, "hessian_sparse", None)):
+                raise NotImplementedError("Basis does not implement hessian_sparse(), that is needed for sparse correlations.")
+            v = np.asarray(xva["v"])
+            ddbk = self.basis.hessian_sparse(x)
+            E = _sparse_contract(dbk, v)
+            dE = _sparse_contract(dbk, np.asarray(xva["a"])) + _sparse_contract(ddbk, v, v)
             return bk, E, dE
         else:
             raise ValueError("Basis evaluation goal not specified")
@@ -475,6 +576,9 @@ class Pos_gle_with_friction(Pos_gle):
         self.N_basis_elt_kernel = self.N_basis_elt - int(self.basis.const_removed) * self.dim_x
         self.rank_projection = not self.basis.const_removed
 
+    basis_vector_sparse = ModelBase.basis_vector_sparse  # Sparse evaluation is only available for Pos_gle
+
+    @cached_basis_vector
     def basis_vector(self, xva, compute_for="corrs"):
         # We have to deal with the multidimensionnal case as well
         bk = xr.apply_ufunc(self.basis.basis, xva["x"], input_core_dims=[["dim_x"]], output_core_dims=[["dim_basis"]], exclude_dims={"dim_x"}, dask_gufunc_kwargs={"output_sizes": {"dim_basis": self.N_basis_elt}}, dask="parallelized")
@@ -490,9 +594,11 @@ class Pos_gle_with_friction(Pos_gle):
         E = xr.concat([bk, Evel], dim="dim_basis")
         if compute_for == "force":
             return E
-        elif compute_for == "corrs":
+        elif compute_for in ["corrs", "fused"]:
             ddbk = xr.apply_ufunc(self.basis.hessian, xva["x"], input_core_dims=[["dim_x"]], output_core_dims=[["dim_basis", "dim_x", "dim_x'"]], dask_gufunc_kwargs={"output_sizes": {"dim_basis": self.N_basis_elt_kernel, "dim_x": self.dim_x, "dim_x'": self.dim_x}}, dask="parallelized")
             dE = xr.dot(dbk, xva["a"], dims=["dim_x"]) + xr.dot(ddbk, xva["v"], xva["v"].rename({"dim_x": "dim_x'"}), dims=["dim_x", "dim_x'"])
+            if compute_for == "fused":
+                return E, Evel, dE, dbk
             return E, Evel, dE
         else:
             raise ValueError("Basis evaluation goal not specified")
@@ -555,6 +661,9 @@ class Pos_gle_no_vel_basis(Pos_gle):
             self.basis.const_removed = False
             print("Warning: remove_const on basis function have been set to False.")
 
+    basis_vector_sparse = ModelBase.basis_vector_sparse  # Sparse evaluation is only available for Pos_gle
+
+    @cached_basis_vector
     def basis_vector(self, xva, compute_for="corrs"):
         E = xr.apply_ufunc(self.basis.basis, xva["x"], input_core_dims=[["dim_x"]], output_core_dims=[["dim_basis"]], exclude_dims={"dim_x"}, dask_gufunc_kwargs={"output_sizes": {"dim_basis": self.N_basis_elt}}, dask="parallelized")
         if compute_for == "force":
@@ -564,9 +673,11 @@ class Pos_gle_no_vel_basis(Pos_gle):
         elif compute_for == "kernel":
             # Extend the basis for multidim value
             return E.expand_dims({"dim_x": self.dim_x}, axis=-1)
-        elif compute_for == "corrs":
+        elif compute_for in ["corrs", "fused"]:
             dbk = xr.apply_ufunc(self.basis.deriv, xva["x"], input_core_dims=[["dim_x"]], output_core_dims=[["dim_basis", "dim_x"]], dask_gufunc_kwargs={"output_sizes": {"dim_basis": self.N_basis_elt_kernel, "dim_x": self.dim_x}}, dask="parallelized")
             dE = xr.dot(dbk, xva["v"], dims=["dim_x"])
+            if compute_for == "fused":
+                return E, E, dE, E.expand_dims({"dim_x": self.dim_x}, axis=-1)
             return E, E, dE
         else:
             raise ValueError("Basis evaluation goal not specified")
@@ -584,19 +695,25 @@ class Pos_gle_const_kernel(Pos_gle):
         self.N_basis_elt_force = self.N_basis_elt
         self.N_basis_elt_kernel = self.dim_obs
 
+    basis_vector_sparse = ModelBase.basis_vector_sparse  # Sparse evaluation is only available for Pos_gle
+
+    @cached_basis_vector
     def basis_vector(self, xva, compute_for="corrs"):
         bk = xr.apply_ufunc(self.basis.basis, xva["x"], input_core_dims=[["dim_x"]], output_core_dims=[["dim_basis"]], exclude_dims={"dim_x"}, dask_gufunc_kwargs={"output_sizes": {"dim_basis": self.N_basis_elt}}, dask="parallelized")
         if compute_for == "force":
             return bk
         elif compute_for == "pmf":
             return xr.apply_ufunc(self.basis.antiderivative, xva["x"], input_core_dims=[["dim_x"]], output_core_dims=[["dim_basis"]], exclude_dims={"dim_x"}, dask_gufunc_kwargs={"output_sizes": {"dim_basis": self.N_basis_elt}}, dask="parallelized")
-        if compute_for == "kernel":  # For kernel evaluation
+        if compute_for in ["kernel", "fused"]:  # For kernel evaluation
             grad = np.zeros((bk.shape[0], self.dim_obs, self.dim_obs))
             for i in range(self.dim_obs):
                 grad[:, i, i] = 1.0
-            return xr.DataArray(grad, dims=("time", "dim_basis", "dim_x"))
-        elif compute_for == "corrs":
-            return bk, xva["v"].rename({"dim_x": "dim_basis"}), xva["a"].rename({"dim_x": "dim_basis"})
+            grad = xr.DataArray(grad, dims=("time", "dim_basis", "dim_x"))
+            if compute_for == "kernel":
+                return grad
+        if compute_for in ["corrs", "fused"]:
+            corrs = (bk, xva["v"].rename({"dim_x": "dim_basis"}), xva["a"].rename({"dim_x": "dim_basis"}))
+            return corrs + (grad,) if compute_for == "fused" else corrs
         else:
             raise ValueError("Basis evaluation goal not specified")
 
@@ -616,6 +733,9 @@ class Pos_gle_hybrid(Pos_gle):
             self.basis.const_removed = False
             print("Warning: remove_const on basis function have been set to False.")
 
+    basis_vector_sparse = ModelBase.basis_vector_sparse  # Sparse evaluation is only available for Pos_gle
+
+    @cached_basis_vector
     def basis_vector(self, xva, compute_for="corrs"):
         # We have to deal with the multidimensionnal case as well
         bk = xr.apply_ufunc(self.basis.basis, xva["x"], input_core_dims=[["dim_x"]], output_core_dims=[["dim_basis"]], exclude_dims={"dim_x"}, dask_gufunc_kwargs={"output_sizes": {"dim_basis": self.N_basis_elt}}, dask="parallelized")
@@ -627,10 +747,12 @@ class Pos_gle_hybrid(Pos_gle):
             # Extend the basis for multidim value
             return bk.expand_dims({"dim_x": self.dim_x}, axis=-1)
             # return bk.reshape(-1, self.N_basis_elt_kernel - 1, 1)
-        elif compute_for == "corrs":
+        elif compute_for in ["corrs", "fused"]:
             E = xr.concat([xva["v"].rename({"dim_x": "dim_basis"}), bk], dim="dim_basis")
-            dbk = xr.dot(xr.apply_ufunc(self.basis.deriv, xva["x"], input_core_dims=[["dim_x"]], output_core_dims=[["dim_basis", "dim_x"]], dask_gufunc_kwargs={"output_sizes": {"dim_basis": self.N_basis_elt, "dim_x": self.dim_x}}, dask="parallelized"), xva["v"])
+            dbk = xr.dot(xr.apply_ufunc(self.basis.deriv, xva["x"], input_core_dims=[["dim_x"]], output_core_dims=[["dim_basis", "dim_x"]], dask_gufunc_kwargs={"output_sizes": {"dim_basis": self.N_basis_elt, "dim_x": self.dim_x}}, dask="parallelized"), xva["v"], dims=["dim_x"])
             dE = xr.concat([xva["a"].rename({"dim_x": "dim_basis"}), dbk], dim="dim_basis")  # To test
+            if compute_for == "fused":
+                return bk, E, dE, bk.expand_dims({"dim_x": self.dim_x}, axis=-1)
             return bk, E, dE
         else:
             raise ValueError("Basis evaluation goal not specified")
@@ -672,6 +794,7 @@ class Pos_gle_overdamped(ModelBase):
             print("Warning: remove_const on basis function have been set to False.")
         self.rank_projection = rank_projection
 
+    @cached_basis_vector
     def basis_vector(self, xva, compute_for="corrs"):
         E = xr.apply_ufunc(self.basis.basis, xva["x"], input_core_dims=[["dim_x"]], output_core_dims=[["dim_basis"]], exclude_dims={"dim_x"}, dask_gufunc_kwargs={"output_sizes": {"dim_basis": self.N_basis_elt}}, dask="parallelized")
         if compute_for == "force":
@@ -681,9 +804,11 @@ class Pos_gle_overdamped(ModelBase):
         elif compute_for == "kernel":
             return E.expand_dims({"dim_x": self.dim_x}, axis=-1)
             # return E.reshape(-1, self.N_basis_elt_kernel, self.dim_x)
-        elif compute_for == "corrs":
+        elif compute_for in ["corrs", "fused"]:
             dbk = xr.apply_ufunc(self.basis.deriv, xva["x"], input_core_dims=[["dim_x"]], output_core_dims=[["dim_basis", "dim_x"]], dask_gufunc_kwargs={"output_sizes": {"dim_basis": self.N_basis_elt_kernel, "dim_x": self.dim_x}}, dask="parallelized")
             dE = xr.dot(dbk, xva["v"], dims=["dim_x"])
+            if compute_for == "fused":
+                return E, E, dE, E.expand_dims({"dim_x": self.dim_x}, axis=-1)
             return E, E, dE
         else:
             raise ValueError("Basis evaluation goal not specified")
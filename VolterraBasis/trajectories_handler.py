@@ -0,0 +1,224 @@
+import os
+import glob
+from collections import OrderedDict
+
+import numpy as np
+import xarray as xr
+
+
+def to_shared_memmap(xva, folder, prefix="traj"):
+    """
+    Copy the numpy backed variables of a trajectory into memory-mapped files of folder.
+    The returned dataset is then sent by reference to joblib workers instead of being pickled.
+    Variables backed by other arrays (i.e. dask) are kept as they are.
+    """
+    shared = {}
+    for name, var in xva.data_vars.items():
+        if isinstance(var.data, np.ndarray):
+            filename = os.path.join(folder, "{}_{}.npy".format(prefix, name))
+            arr = np.lib.format.open_memmap(filename, mode="w+", dtype=var.dtype, shape=var.shape)
+            arr[...] = var.data
+            arr.flush()
+            del arr
+            shared[name] = var.copy(data=np.load(filename, mmap_mode="r"))
+        else:
+            shared[name] = var
+    return xva.assign(shared)
+
+
+class Trajectories_handler(object):
+    """
+    Out-of-core collection of trajectories stored as NetCDF or Zarr files.
+    Trajectories are opened lazily when accessed and only a bounded number of them are kept resident.
+    It can be used in place of the list of datasets given to Estimator_gle.
+    """
+
+    extensions = (".nc", ".nc4", ".netcdf", ".zarr")
+
+    def __init__(self, files, max_resident=1, chunks=None, load=False, engine=None):
+        """
+        Parameters
+        ----------
+        files : str or list of str
+            Directory containing the trajectory files, glob pattern or list of files.
+        max_resident : int, default=1
+            Maximum number of opened trajectories kept at once.
+        chunks : dict, default=None
+            Chunks passed to xarray when opening the files. If set the trajectories are backed by dask arrays.
+        load : bool, default=False
+            Load the opened trajectories into memory. Otherwise data are read from disk when needed.
+        engine : str, default=None
+            Engine used by xarray to open NetCDF files.
+        """
+        if isinstance(files, (str, os.PathLike)):
+            files = os.fspath(files)
+            if os.path.isdir(files) and not files.endswith(".zarr"):
+                files = sorted(os.path.join(files, f) for f in os.listdir(files) if f.endswith(self.extensions))
+            else:
+                files = sorted(glob.glob(files))
+        self.files = list(files)
+        if len(self.files) == 0:
+            raise ValueError("No trajectory files found.")
+        if max_resident < 1:
+            raise ValueError("max_resident should be at least 1.")
+        self.max_resident = int(max_resident)
+        self.chunks = chunks
+        self.load = load
+        self.engine = engine
+        self.transforms = []
+        self._resident = OrderedDict()
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i in self._resident:
+            self._resident.move_to_end(i)
+            return self._resident[i]
+        xva = self._open(self.files[i])
+        for transform in self.transforms:
+            xva = transform(xva)
+        self._resident[i] = xva
+        while len(self._resident) > self.max_resident:
+            _, old = self._resident.popitem(last=False)
+            old.close()
+        return xva
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _open(self, filename):
+        if filename.rstrip("/").endswith(".zarr"):
+            xva = xr.open_zarr(filename, chunks=self.chunks)
+        else:
+            xva = xr.open_dataset(filename, chunks=self.chunks, engine=self.engine)
+        if self.load:
+            xva.load()
+        return xva
+
+    def add_transform(self, func):
+        """
+        Add a function applied to each trajectory when it is opened.
+        func take a dataset and return the updated dataset.
+        """
+        self.transforms.append(func)
+        self.clear()
+
+    def clear(self):
+        """
+        Close all resident trajectories
+        """
+        while self._resident:
+            _, old = self._resident.popitem(last=False)
+            old.close()
+
+    @staticmethod
+    def save(xva_list, directory, fmt="nc", prefix="traj"):
+        """
+        Write a list of trajectories into directory, one file per trajectory, and return the corresponding handler.
+
+        Parameters
+        ----------
+        fmt : {"nc","zarr"}, default="nc"
+            Format of the files.
+        """
+        if fmt not in ["nc", "zarr"]:
+            raise ValueError("Unknown format {}".format(fmt))
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for n, xva in enumerate(xva_list):
+            filename = os.path.join(directory, "{}_{:05d}.{}".format(prefix, n, fmt))
+            if fmt == "zarr":
+                xva.to_zarr(filename, mode="w")
+            else:
+                xva.to_netcdf(filename)
+            files.append(filename)
+        return Trajectories_handler(files)
+
+
+class Trajectory_writer(object):
+    """
+    Write a trajectory into a NetCDF or Zarr file by successive chunks along time.
+    Only the chunk being written is held in memory.
+    """
+
+    def __init__(self, filename, dims, variables=("x", "v"), fmt=None, attrs=None):
+        """
+        Parameters
+        ----------
+        filename : str
+            Output file
+        dims : dict
+            Names and sizes of the dimensions of the variables, besides time.
+        variables : list of str, default=("x", "v")
+            Names of the variables
+        fmt : {"nc","zarr"}, default=None
+            Format of the file. If None, it is deduced from the extension of filename.
+        attrs : dict, default=None
+            Global attributes of the file.
+        """
+        self.filename = os.fspath(filename)
+        if fmt is None:
+            fmt = "zarr" if self.filename.rstrip("/").endswith(".zarr") else "nc"
+        if fmt not in ["nc", "zarr"]:
+            raise ValueError("Unknown format {}".format(fmt))
+        self.fmt = fmt
+        self.dims = dict(dims)
+        self.variables = list(variables)
+        self.attrs = {} if attrs is None else dict(attrs)
+        self.n_written = 0
+        self._nc = None
+        if self.fmt == "nc":
+            import netCDF4
+
+            self._nc = netCDF4.Dataset(self.filename, "w")
+            self._nc.createDimension("time", None)
+            for name, size in self.dims.items():
+                self._nc.createDimension(name, size)
+            self._nc.createVariable("time", "f8", ("time",))
+            for name in self.variables:
+                self._nc.createVariable(name, "f8", ("time",) + tuple(self.dims))
+            self._nc.setncatts(self.attrs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, time, **arrays):
+        """
+        Append a chunk. time is an array (n,) and each variable an array (n, *dims).
+        """
+        n = len(time)
+        if self.fmt == "nc":
+            self._nc["time"][self.n_written : self.n_written + n] = time
+            for name in self.variables:
+                self._nc[name][self.n_written : self.n_written + n] = arrays[name]
+            self._nc.sync()
+        else:
+            chunk = xr.Dataset({name: (("time",) + tuple(self.dims), arrays[name]) for name in self.variables}, coords={"time": time}, attrs=self.attrs)
+            if self.n_written == 0:
+                chunk.to_zarr(self.filename, mode="w")
+            else:
+                chunk.to_zarr(self.filename, append_dim="time")
+        self.n_written += n
+
+    def close(self):
+        if self._nc is not None:
+            self._nc.close()
+            self._nc = None
+
+    def open(self, chunks=None):
+        """
+        Open the written trajectory as a lazy dataset.
+        """
+        self.close()
+        if self.fmt == "zarr":
+            return xr.open_zarr(self.filename, chunks=chunks)
+        return xr.open_dataset(self.filename, chunks=chunks)
@@ -0,0 +1,215 @@
+import numpy as np
+import scipy.fft
+
+from .correlation import correlation_rfft_ND
+
+
+def solve_volterra_toeplitz(C, D, P, h, sign_hist=1.0, sign_rhs=1.0, k0=None, w0=1.0, n_out=None, leaf_size=64):
+    """
+    Solve the discretized Volterra equation
+
+    K_n = P (sign_hist * h * sum_{j<n} C_{n-j} w_j K_j + sign_rhs * D_n)
+
+    using a divide-and-conquer scheme (Hairer, Lubich and Schlichte) where the history sums between blocks are computed by FFT.
+    This scale as O(N log^2 N) instead of O(N^2) for the step by step solution.
+
+    Parameters
+    ----------
+    C : array (dim_basis, dim_basis, n_lags)
+        Lagged matrices, C[..., m] is used for lag m. C[..., 0] is not used.
+    D : array (dim_basis, dim_x, N)
+        Right hand side.
+    P : array (dim_basis, dim_basis)
+        Inverse of the matrix in front of K_n
+    k0 : array (dim_basis, dim_x), default=None
+        If given, value of K_0. Otherwise K_0 is obtained from the equation.
+    w0 : float, default=1.0
+        Quadrature weight of K_0 in the history sums
+    n_out : int, default=N
+        Length of the output. Values after N are set to zero.
+    leaf_size : int, default=64
+        Size of the blocks solved step by step.
+
+    Returns
+    -------
+    K : array (n_out, dim_basis, dim_x)
+    """
+    N = D.shape[-1]
+    if n_out is None:
+        n_out = N
+    dim_b, dim_x = D.shape[0], D.shape[1]
+    K = np.zeros((dim_b, dim_x, max(N, n_out)))
+    G = np.zeros((dim_b, dim_x, N))  # Weighted values of the kernel that enter the history sums
+    H = np.zeros((C.shape[0], dim_x, N))  # History sums
+    C_hat = {}  # Transforms of the lags, depending only of the size of the block
+
+    def solve_leaf(lo, hi):
+        for n in range(lo, hi):
+            if n > lo:
+                H[:, :, n] += np.einsum("ijm,jkm->ik", C[:, :, n - lo : 0 : -1], G[:, :, lo:n])
+            if n == 0 and k0 is not None:
+                K[:, :, 0] = k0
+            else:
+                K[:, :, n] = P @ (sign_hist * h * H[:, :, n] + sign_rhs * D[:, :, n])
+            G[:, :, n] = (w0 if n == 0 else 1.0) * K[:, :, n]
+
+    def solve(lo, hi):
+        if hi - lo <= leaf_size:
+            solve_leaf(lo, hi)
+            return
+        mid = (lo + hi) // 2
+        solve(lo, mid)
+        # Contribution of K[lo:mid] to the history sums of [mid:hi), lags from 1 to hi-lo-1
+        size = hi - lo
+        n_fft = scipy.fft.next_fast_len(mid - lo + size - 2, real=True)
+        if (size, n_fft) not in C_hat:
+            C_hat[(size, n_fft)] = scipy.fft.rfft(C[:, :, 1:size], n=n_fft, axis=-1)
+        G_hat = scipy.fft.rfft(G[:, :, lo:mid], n=n_fft, axis=-1)
+        conv = scipy.fft.irfft(np.einsum("ijf,jkf->ikf", C_hat[(size, n_fft)], G_hat), n=n_fft, axis=-1)
+        H[:, :, mid:hi] += conv[:, :, mid - lo - 1 : size - 1]
+        solve(mid, hi)
+
+    solve(0, N)
+    K[:, :, N:] = 0.0
+    return np.moveaxis(K[:, :, :n_out], -1, 0)
+
+
+def kernel_first_kind_rect_fft(B, DxB, dt, leaf_size=64):
+    """
+    Same result as kernel_first_kind_rect with fast history sums.
+    """
+    T = B.shape[-1]
+    P = np.linalg.inv(dt * B[:, :, 1])
+    return solve_volterra_toeplitz(B[:, :, 1:], DxB[:, :, 1:], P, dt, -1.0, -1.0, n_out=T, leaf_size=leaf_size)
+
+
+def kernel_first_kind_midpoint_fft(B, DxB, dt, leaf_size=64):
+    """
+    Same result as kernel_first_kind_midpoint with fast history sums.
+    """
+    T = B.shape[-1]
+    N = (T - 1) // 2  # Number of points computed by the step by step method
+    P = np.linalg.inv(2 * dt * B[:, :, 1])
+    return solve_volterra_toeplitz(B[:, :, 0 : 2 * N : 2], DxB[:, :, 1 : 2 * N : 2], P, 2 * dt, -1.0, -1.0, n_out=(T - 2) // 2 + 1, leaf_size=leaf_size)
+
+
+def kernel_first_kind_trapz_fft(k0, B, DxB, dt, leaf_size=64):
+    """
+    Same result as kernel_first_kind_trapz with fast history sums.
+    """
+    P = np.linalg.inv(0.5 * dt * B[:, :, 0])
+    return solve_volterra_toeplitz(B, DxB, P, dt, -1.0, -1.0, k0=k0, w0=0.5, leaf_size=leaf_size)
+
+
+def kernel_second_kind_rect_fft(k0, B0, Bdot, DxBdot, dt, leaf_size=64):
+    """
+    Same result as kernel_second_kind_rect with fast history sums.
+    """
+    P = np.linalg.inv(B0)
+    return solve_volterra_toeplitz(Bdot, DxBdot, P, dt, 1.0, 1.0, k0=k0, leaf_size=leaf_size)
+
+
+def kernel_second_kind_trapz_fft(k0, B0, Bdot, DxBdot, dt, leaf_size=64):
+    """
+    Same result as kernel_second_kind_trapz with fast history sums.
+    """
+    P = np.linalg.inv(B0 - 0.5 * dt * Bdot[:, :, 0])
+    return solve_volterra_toeplitz(Bdot, DxBdot, P, dt, 1.0, 1.0, k0=k0, w0=0.5, leaf_size=leaf_size)
+
+
+def _causal_convolution(E, kernel, block_size=None):
+    """
+    Return res[i] = sum_{j=0}^{min(i, len_mem-1)} E[i-j] @ kernel[j] by overlap-add of blocks of E.
+    E is (lenTraj, dim_basis) and kernel (len_mem, dim_basis, dim_x).
+    """
+    len_traj, len_mem = E.shape[0], kernel.shape[0]
+    if block_size is None:
+        block_size = max(4 * len_mem, 1024)
+    n_fft = scipy.fft.next_fast_len(block_size + len_mem - 1, real=True)
+    block_size = n_fft - len_mem + 1  # Use all the available length
+    kernel_hat = scipy.fft.rfft(kernel, n=n_fft, axis=0)
+    res = np.zeros((len_traj + n_fft, kernel.shape[2]))
+    for start in range(0, len_traj, block_size):
+        E_hat = scipy.fft.rfft(E[start : start + block_size], n=n_fft, axis=0)
+        res[start : start + n_fft] += scipy.fft.irfft(np.einsum("fb,fbx->fx", E_hat, kernel_hat), n=n_fft, axis=0)
+    return res[:len_traj]
+
+
+def memory_fft(kernel, E, dt, method="rect", block_size=None):
+    """
+    Same result as memory_rect and memory_trapz using FFT convolution by blocks,
+    that is O(N log len_mem) instead of O(N len_mem).
+
+    Parameters
+    ----------
+    kernel : array (len_mem, dim_basis, dim_x)
+    E : array (lenTraj, dim_basis)
+    method : {"rect", "trapz"}, default="rect"
+        Quadrature of the memory integral.
+    block_size : int, default=None
+        Number of time steps of E per transform.
+    """
+    kernel = np.asarray(kernel)
+    E = np.asarray(E)
+    len_traj, len_mem = E.shape[0], kernel.shape[0] - 1
+    memory = _causal_convolution(E, kernel, block_size=block_size)
+    if method == "trapz":  # Correct end points weights as done in memory_trapz
+        memory -= 0.5 * E @ kernel[0]
+        n_start = min(len_mem, len_traj - 1)
+        memory[1 : n_start + 1] -= 0.5 * np.einsum("b,nbx->nx", E[0], kernel[1 : n_start + 1])
+        memory[len_mem + 1 :] += 0.5 * E[1 : len_traj - len_mem] @ kernel[len_mem]
+    elif method != "rect":
+        raise ValueError("Unknown quadrature {}".format(method))
+    memory[0] = 0.0
+    return -dt * memory
+
+
+def corrs_fft(noise, kernel, E, left_op, dt, method="rect"):
+    """
+    Same result as corrs_rect and corrs_trapz, computed from the correlations of left_op with the noise and with E.
+
+    The projected noise at lag n is the noise at time t+n plus the memory integral between t and t+n,
+    such that the correlation is a convolution in lag of the kernel with the correlation of left_op and E.
+    Only the terms at the end of the trajectory, that does not enter the correlation, are computed explicitly
+    at a cost that does not depend of the length of the trajectory.
+
+    Parameters
+    ----------
+    noise : array (lenTraj, dim_x)
+    kernel : array (len_mem, dim_basis, dim_x)
+    E : array (lenTraj, dim_basis)
+    left_op : array (lenTraj, dim_obs)
+    method : {"rect", "trapz"}, default="rect"
+        Quadrature of the memory integral.
+    """
+    noise, kernel, E, left_op = np.asarray(noise), np.asarray(kernel), np.asarray(E), np.asarray(left_op)
+    N, len_mem = E.shape[0], kernel.shape[0] - 1
+    if method == "rect":
+        n_corrs, m_start = len_mem + 1, 1
+    elif method == "trapz":
+        n_corrs, m_start = len_mem, 0
+    else:
+        raise ValueError("Unknown quadrature {}".format(method))
+    if N <= 2 * len_mem + 1:
+        raise ValueError("Trajectory should be longer than twice the kernel.")
+    lags = np.arange(n_corrs)
+    corrs_noise = correlation_rfft_ND(left_op.T[:, np.newaxis, :], noise.T[np.newaxis, :, :], trunc=n_corrs)
+    R = correlation_rfft_ND(left_op.T[:, np.newaxis, :], E.T[np.newaxis, :, :], trunc=n_corrs) * (N - lags)  # Unnormalized
+
+    # Convolution in lag sum_k R(n-k) K_k for k=0..n
+    n_fft = scipy.fft.next_fast_len(2 * n_corrs - 1, real=True)
+    conv = scipy.fft.irfft(np.einsum("obf,fbx->fox", scipy.fft.rfft(R, n=n_fft, axis=-1), scipy.fft.rfft(kernel[:n_corrs], n=n_fft, axis=0)), n=n_fft, axis=0)[:n_corrs]
+    if method == "rect":  # Weights 1 for k<n and 0 for k=n
+        conv -= np.einsum("ob,nbx->nox", R[:, :, 0], kernel[:n_corrs])
+    else:  # Weights 0.5 for k=0 and k=n, no terms at n=0
+        conv -= 0.5 * np.einsum("obn,bx->nox", R, kernel[0]) + 0.5 * np.einsum("ob,nbx->nox", R[:, :, 0], kernel[:n_corrs])
+        conv[0] = 0.0
+
+    # Remove the terms at the end of the trajectory that are out of the correlation window
+    edge = np.zeros_like(conv)
+    for m in range(m_start, n_corrs - 1):
+        v = np.arange(1, n_corrs - m)
+        cumul = np.cumsum(np.einsum("vo,vb->vob", left_op[N - m - v], E[N - v]), axis=0)
+        edge[m + 1 :] += (0.5 if m == 0 else 1.0) * np.einsum("kob,kbx->kox", cumul, kernel[1 : n_corrs - m])
+
+    return np.moveaxis(corrs_noise, -1, 0) + dt * (conv - edge) / (N - lags)[:, np.newaxis, np.newaxis]
@@ -114,3 +114,64 @@ def test_fem_2d():
     basis.fit(pts)
     assert basis.basis(pts).shape == (n_points, basis_fem.N)
     assert basis.deriv(pts).shape == (n_points, basis_fem.N, 2)
+    with pytest.raises(NotImplementedError):
+        basis.hessian_sparse(pts)
+
+
+@pytest.mark.parametrize("n_knots,k,periodic", [(8, 3, False), (6, 1, False), (9, 4, True)])
+def test_bspline_de_boor(n_knots, k, periodic):
+    import scipy.interpolate
+
+    x_range = np.linspace(-12, 12, 97).reshape(-1, 1)  # Include extrapolation
+    basis = bf.BSplineFeatures(n_knots, k=k, periodic=periodic, remove_const=False).fit(np.linspace(-10, 10, 40).reshape(-1, 1))
+    for n, spline in enumerate(basis.bsplines_):
+        np.testing.assert_allclose(basis.basis(x_range)[:, n], scipy.interpolate.splev(x_range[:, 0], spline), atol=1e-12)
+        np.testing.assert_allclose(basis.deriv(x_range)[:, n, 0], scipy.interpolate.splev(x_range[:, 0], spline, der=1), atol=1e-12)
+        np.testing.assert_allclose(basis.hessian(x_range)[:, n, 0, 0], scipy.interpolate.splev(x_range[:, 0], spline, der=2) if k >= 2 else 0.0, atol=1e-12)
+        np.testing.assert_allclose(basis.antiderivative(x_range)[:, n], scipy.interpolate.splev(x_range[:, 0], scipy.interpolate.splantider(spline)), atol=1e-10)
+
+
+def test_bspline_sparse():
+    x_range = np.linspace(-12, 12, 97).reshape(-1, 1)
+    basis = bf.BSplineFeatures(8).fit(np.linspace(-10, 10, 40).reshape(-1, 1))
+    np.testing.assert_allclose(basis.basis_sparse(x_range).todense(), basis.basis(x_range))
+    np.testing.assert_allclose(basis.deriv_sparse(x_range).todense(), basis.deriv(x_range))
+    np.testing.assert_allclose(basis.hessian_sparse(x_range).todense(), basis.hessian(x_range))
+
+
+def test_smooth_indicator_sparse():
+    x_range = np.linspace(-10, 10, 97).reshape(-1, 1)
+    basis = bf.SmoothIndicatorFeatures([[-5, -2], [2, 3], [5, 7]], "tricube").fit(x_range)
+    np.testing.assert_allclose(basis.basis_sparse(x_range).todense(), basis.basis(x_range))
+    np.testing.assert_allclose(basis.deriv_sparse(x_range).todense(), basis.deriv(x_range))
+    np.testing.assert_allclose(basis.hessian_sparse(x_range).todense(), basis.hessian(x_range))
+
+
+@pytest.mark.parametrize("polynom", [np.polynomial.Polynomial, np.polynomial.Chebyshev, np.polynomial.Legendre, np.polynomial.Hermite, np.polynomial.HermiteE, np.polynomial.Laguerre])
+def test_polynomial_recurrence(polynom):
+    x = np.linspace(-1.5, 1.5, 25).reshape(-1, 1)
+    basis = bf.PolynomialFeatures(deg=5, polynom=polynom, remove_const=True).fit(x)
+    ref = np.stack([polynom.basis(n)(x[:, 0]) for n in range(6)], axis=1)
+    np.testing.assert_allclose(basis.basis(x), ref, atol=1e-10)
+    for order in [1, 2, 3]:
+        ref_der = np.stack([polynom.basis(n).deriv(order)(x[:, 0]) for n in range(1, 6)], axis=1)
+        np.testing.assert_allclose(basis.deriv(x, deriv_order=order)[(Ellipsis,) + (0,) * order], ref_der, atol=1e-10)
+
+
+def test_fourier_recurrence():
+    x = np.linspace(-3, 3, 20).reshape(-1, 2)
+    freq = 1.3
+    basis = bf.FourierFeatures(order=4, freq=freq, remove_const=False).fit(x)
+    ref = [np.ones_like(x) / np.sqrt(2 * np.pi)]
+    ref_der = [np.zeros_like(x)]
+    ref_hess = [np.zeros_like(x)]
+    for m in range(1, 5):
+        ref += [np.sin(m * freq * x) / np.sqrt(np.pi), np.cos(m * freq * x) / np.sqrt(np.pi)]
+        ref_der += [m * freq * np.cos(m * freq * x) / np.sqrt(np.pi), -m * freq * np.sin(m * freq * x) / np.sqrt(np.pi)]
+        ref_hess += [-((m * freq) ** 2) * np.sin(m * freq * x) / np.sqrt(np.pi), -((m * freq) ** 2) * np.cos(m * freq * x) / np.sqrt(np.pi)]
+    np.testing.assert_allclose(basis.basis(x), np.concatenate(ref, axis=1), atol=1e-12)
+    deriv, hess = basis.deriv(x), basis.hessian(x)
+    np.testing.assert_allclose(deriv[:, ::2, 0], np.stack(ref_der, axis=1)[..., 0], atol=1e-12)
+    np.testing.assert_allclose(deriv[:, 1::2, 1], np.stack(ref_der, axis=1)[..., 1], atol=1e-12)
+    np.testing.assert_allclose(deriv[:, ::2, 1], 0.0)
+    np.testing.assert_allclose(hess[:, 1::2, 1, 1], np.stack(ref_hess, axis=1)[..., 1], atol=1e-12)
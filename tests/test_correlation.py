@@ -0,0 +1,76 @@
+import pytest
+import numpy as np
+import VolterraBasis.correlation as corr
+
+
+@pytest.fixture
+def signals():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(4, 1000)), rng.normal(size=(2, 1000))
+
+
+@pytest.mark.parametrize("block_size", [None, 1, 37, 250, 1000, 5000])
+def test_correlation_blocks(signals, block_size):
+    a, b = signals
+    ref = corr.correlation_ND(a[:, np.newaxis, :], b[np.newaxis, :, :], trunc=100)
+    res = corr.correlation_blocks_ND(a[:, np.newaxis, :], b[np.newaxis, :, :], trunc=100, block_size=block_size)
+    assert res.shape == (4, 2, 100)
+    np.testing.assert_allclose(res, ref, atol=1e-12)
+
+    np.testing.assert_allclose(corr.correlation_blocks_ND(a, trunc=100, block_size=block_size), corr.correlation_ND(a, trunc=100), atol=1e-12)
+    np.testing.assert_allclose(corr.correlation_blocks_ND(a[0], b[0], trunc=100, block_size=block_size), corr.correlation_1D(a[0], b[0], trunc=100), atol=1e-12)
+
+
+@pytest.mark.parametrize("trunc", [None, 1, 100])
+@pytest.mark.parametrize("fast", [False, True])
+@pytest.mark.parametrize("max_elements", [2**24, 3000, 1])
+def test_correlation_sym(signals, trunc, fast, max_elements):
+    a, b = signals
+    res = corr.correlation_spectra_ND(a, b, pairs=[(0, 0), (0, 1)], trunc=trunc, fast=fast, max_elements=max_elements)
+    np.testing.assert_allclose(res[0], corr.correlation_ND(a[:, np.newaxis, :], a[np.newaxis, :, :], trunc=trunc), atol=1e-12)
+    np.testing.assert_allclose(res[1], corr.correlation_ND(a[:, np.newaxis, :], b[np.newaxis, :, :], trunc=trunc), atol=1e-12)
+
+
+@pytest.mark.parametrize("trunc", [None, 1, 100])
+@pytest.mark.parametrize("workers", [None, 2])
+def test_correlation_rfft(signals, trunc, workers):
+    a, b = signals
+    ref = corr.correlation_ND(a[:, np.newaxis, :], b[np.newaxis, :, :], trunc=trunc)
+    np.testing.assert_allclose(corr.correlation_rfft_ND(a[:, np.newaxis, :], b[np.newaxis, :, :], trunc=trunc, workers=workers), ref, atol=1e-12)
+    np.testing.assert_allclose(corr.correlation_rfft_ND(a, trunc=trunc), corr.correlation_ND(a, trunc=trunc), atol=1e-12)
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_correlation_spectra(signals, fast):
+    a, b = signals
+    pairs = [(0, 1), (0, 0), (1, 0)]
+    res = corr.correlation_spectra_ND(a, b, pairs=pairs, trunc=100, fast=fast)
+    assert len(res) == len(pairs)
+    for (i, j), cor in zip(pairs, res):
+        ref = corr.correlation_ND(signals[i][:, np.newaxis, :], signals[j][np.newaxis, :, :], trunc=100)
+        np.testing.assert_allclose(cor, ref, atol=1e-12)
+
+
+@pytest.mark.parametrize("chunks", [1000, 256, 37])
+@pytest.mark.parametrize("fast", [False, True])
+def test_correlation_chunks(signals, chunks, fast):
+    da = pytest.importorskip("dask.array")
+    a, b = signals
+    pairs = [(0, 1), (0, 0), (1, 0)]
+    res = corr.correlation_chunks_ND(da.from_array(a, chunks=(-1, chunks)), da.from_array(b, chunks=(-1, 300)), pairs=pairs, trunc=100, fast=fast)
+    for (i, j), cor in zip(pairs, res):
+        ref = corr.correlation_ND(signals[i][:, np.newaxis, :], signals[j][np.newaxis, :, :], trunc=100)
+        np.testing.assert_allclose(cor.compute(), ref, atol=1e-12)
+
+
+@pytest.mark.parametrize("trunc", [None, 1, 100])
+def test_correlation_sparse(signals, trunc):
+    scipy_sparse = pytest.importorskip("scipy.sparse")
+    a, b = signals
+    a = np.where(np.abs(a) > 1.0, a, 0.0)  # Sparse signal
+    a_sparse = scipy_sparse.csr_matrix(a.T)
+    ref = corr.correlation_ND(a[:, np.newaxis, :], b[np.newaxis, :, :], trunc=trunc)
+    np.testing.assert_allclose(corr.correlation_sparse_ND(a_sparse, b.T, trunc=trunc), ref, atol=1e-12)
+    ref = corr.correlation_ND(a[:, np.newaxis, :], a[np.newaxis, :, :], trunc=trunc)
+    np.testing.assert_allclose(corr.correlation_sparse_ND(a_sparse, trunc=trunc), ref, atol=1e-12)
+    np.testing.assert_allclose(corr.correlation_sparse_ND(a_sparse, scipy_sparse.csr_matrix(b.T), trunc=trunc), corr.correlation_sparse_ND(a_sparse, b.T, trunc=trunc), atol=1e-12)
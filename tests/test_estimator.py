@@ -56,6 +56,25 @@ def test_estimator(traj_list, n_jobs, request):
     assert corrs_noise.shape == (198, 1, 1)
 
 
+@pytest.mark.parametrize("traj_list", ["numpy"], indirect=True)
+def test_parallel_pool(traj_list):
+    ref = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False, n_jobs=1)
+    ref.compute_mean_force()
+    ref.compute_corrs()
+
+    estimator = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False, n_jobs=2)
+    for _ in range(2):
+        estimator.compute_mean_force()
+        estimator.compute_corrs()
+        assert isinstance(estimator._shared_xva_list[0]["x"].data, np.memmap)
+        assert estimator._parallel._managed_backend  # Workers are kept between calls
+        np.testing.assert_allclose(estimator.model.force_coeff, ref.model.force_coeff, atol=1e-12)
+        np.testing.assert_allclose(estimator.bkbkcorrw, ref.bkbkcorrw, atol=1e-12)
+    pool = estimator._parallel
+    estimator.close()
+    assert estimator._parallel is None and not pool._managed_backend
+
+
 @pytest.mark.parametrize("traj_list", ["numpy", "dask"], indirect=True)
 @pytest.mark.parametrize("method", ["rect", "trapz", "trapz_stab"])
 def test_gfpe(traj_list, method):
@@ -84,9 +103,102 @@ def test_gfpe(traj_list, method):
     # assert flux.shape == (500, 10)
 
 
+@pytest.mark.parametrize("traj_list", ["numpy"], indirect=True)
+@pytest.mark.parametrize("chunks", [None, {"time": 5000}])
+def test_trajectories_handler(traj_list, chunks, tmp_path):
+    handler = vb.Trajectories_handler.save(traj_list, tmp_path)
+    handler = vb.Trajectories_handler(tmp_path, max_resident=1, chunks=chunks)
+    assert len(handler) == len(traj_list)
+
+    estimator = vb.Estimator_gle(handler, vb.Pos_gle, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False)
+    ref = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False)
+    for est in [estimator, ref]:
+        est.compute_mean_force()
+        est.compute_corrs()
+    assert len(handler._resident) <= 1
+    np.testing.assert_allclose(estimator.model.force_coeff, ref.model.force_coeff)
+    np.testing.assert_allclose(estimator.bkbkcorrw, ref.bkbkcorrw, atol=1e-12)
+
+    estimator = vb.Estimator_gle(str(tmp_path), vb.Pos_gle_overdamped, bf.BSplineFeatures(10, remove_const=False), trunc=1, saveall=False, verbose=False)
+    estimator.to_gfpe()
+    assert estimator.model.dim_obs == 10
+    model = estimator.compute_mean_force()
+    assert model.force_coeff.shape == (10, 10)
+
+
+@pytest.mark.parametrize("traj_list", ["numpy", "dask"], indirect=True)
+@pytest.mark.parametrize("second_order_method", [True, False])
+def test_fused(traj_list, second_order_method):
+    estimator = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False)
+    model = estimator.compute_fused(second_order_method=second_order_method)
+    fused = {k: np.asarray(getattr(estimator, k)) for k in ["bkdxcorrw", "dotbkdxcorrw", "bkbkcorrw", "dotbkbkcorrw"]}
+    assert model.gram_kernel.shape == (9, 9)
+
+    estimator.compute_mean_force()
+    estimator.compute_effective_mass()
+    estimator.compute_corrs(second_order_method=second_order_method)
+    for k, val in fused.items():
+        np.testing.assert_allclose(val, getattr(estimator, k), atol=1e-10)
+
+
+@pytest.mark.parametrize("traj_list", ["numpy"], indirect=True)
+@pytest.mark.parametrize("remove_const", [True, False])
+def test_fused_basis_calls(traj_list, remove_const, monkeypatch):
+    calls = {"basis": 0, "deriv": 0, "hessian": 0}
+
+    def counted(name):
+        func = getattr(bf.BSplineFeatures, name)
+
+        def wrapper(self, X, **kwargs):
+            calls[name] += kwargs.get("deriv_order", 1) == 1  # hessian call deriv with deriv_order=2
+            return func(self, X, **kwargs)
+
+        return wrapper
+
+    for name in calls:
+        monkeypatch.setattr(bf.BSplineFeatures, name, counted(name))
+    traj_list[1] = traj_list[1].isel(time=slice(0, 15000))  # Trajectories of the fixture are identical
+    estimator = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10, remove_const=remove_const), trunc=1, saveall=False, verbose=False)
+    model = estimator.compute_fused()
+    assert calls == {"basis": len(traj_list), "deriv": len(traj_list), "hessian": len(traj_list)}
+    assert model.basis_cache is None
+    fused = {k: np.asarray(getattr(model, k)) for k in ["force_coeff", "eff_mass", "gram_kernel"]}
+
+    estimator.compute_mean_force()
+    estimator.compute_effective_mass()
+    estimator.compute_corrs()
+    estimator.compute_gram_kernel()
+    for k, val in fused.items():
+        np.testing.assert_allclose(val, getattr(model, k), atol=1e-10)
+
+
+@pytest.mark.parametrize("traj_list", ["numpy", "dask"], indirect=True)
+@pytest.mark.parametrize("second_order_method", [True, False])
+def test_sparse(traj_list, second_order_method):
+    estimator = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False)
+    model = estimator.compute_mean_force()
+    force_coeff, gram_force = np.asarray(model.force_coeff), np.asarray(model.gram_force)
+    gram_kernel = np.asarray(estimator.compute_gram_kernel().gram_kernel)
+    estimator.compute_corrs(second_order_method=second_order_method)
+    dense = {k: getattr(estimator, k) for k in ["bkdxcorrw", "dotbkdxcorrw", "bkbkcorrw", "dotbkbkcorrw"]}
+
+    model = estimator.compute_mean_force(sparse=True)
+    np.testing.assert_allclose(model.force_coeff, force_coeff, atol=1e-10)
+    np.testing.assert_allclose(model.gram_force, gram_force, atol=1e-10)
+    np.testing.assert_allclose(estimator.compute_gram_kernel(sparse=True).gram_kernel, gram_kernel, atol=1e-10)
+    estimator.compute_corrs(method="sparse", second_order_method=second_order_method)
+    for k, val in dense.items():
+        assert getattr(getattr(estimator, k), "dims", None) == getattr(val, "dims", None)
+        np.testing.assert_allclose(getattr(estimator, k), val, atol=1e-10)
+
+    estimator = vb.Estimator_gle(traj_list, vb.Pos_gle_with_friction, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False)
+    with pytest.raises(NotImplementedError):
+        estimator.compute_mean_force(sparse=True)
+
+
 # Parametrize test on correlation computation method
 @pytest.mark.parametrize("traj_list", ["numpy", "dask"], indirect=True)
-@pytest.mark.parametrize("method,vectorize", [("fft", False), ("fft", True), ("direct", False), ("direct", True)])
+@pytest.mark.parametrize("method,vectorize", [("fft", False), ("fft", True), ("direct", False), ("direct", True), ("fft_blocks", False), ("fft_blocks", True), ("rfft", False), ("rfft", True)])
 def test_corrs_method(traj_list, method, vectorize):
     estimator = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10, remove_const=False), trunc=1, saveall=False, verbose=False)
     estimator.set_zero_force()
@@ -99,6 +211,31 @@ def test_corrs_method(traj_list, method, vectorize):
     assert estimator.dotbkbkcorrw[0, 0] == 0
 
 
+@pytest.mark.parametrize("traj_list", ["numpy"], indirect=True)
+@pytest.mark.parametrize("block_size", [150, 1000])
+@pytest.mark.parametrize("second_order_method", [True, False])
+def test_corrs_fft_blocks(traj_list, block_size, second_order_method, monkeypatch):
+    traj_list = [xva.isel(time=slice(0, 4321)) for xva in traj_list]  # Length is not a multiple of the block size
+    estimator = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False)
+    estimator.compute_mean_force()
+    estimator.compute_corrs(method="fft", second_order_method=second_order_method)
+    ref = {k: getattr(estimator, k) for k in ["bkdxcorrw", "dotbkdxcorrw", "bkbkcorrw", "dotbkbkcorrw"]}
+
+    lengths = []
+    basis_vector = vb.Pos_gle.basis_vector
+
+    def recorded(self, xva, compute_for="corrs"):
+        lengths.append(xva["time"].shape[0])
+        return basis_vector(self, xva, compute_for=compute_for)
+
+    monkeypatch.setattr(vb.Pos_gle, "basis_vector", recorded)
+    estimator.compute_corrs(method="fft_blocks", block_size=block_size, second_order_method=second_order_method)
+    assert max(lengths) <= block_size + estimator.model.trunc_ind - 1  # The basis is never evaluated on the whole trajectory
+    for k, val in ref.items():
+        assert getattr(getattr(estimator, k), "dims", None) == getattr(val, "dims", None)
+        np.testing.assert_allclose(getattr(estimator, k), val, atol=1e-10)
+
+
 # Parametrize test on invertion method
 @pytest.mark.parametrize("traj_list", ["dask"], indirect=True)
 @pytest.mark.parametrize("method,expected", [("rect", (2000, 9, 1)), ("midpoint", (1000, 9, 1)), ("midpoint_w_richardson", (333, 9, 1)), ("trapz", (1999, 9, 1)), ("second_kind_rect", (2000, 9, 1)), ("second_kind_trapz", (2000, 9, 1))])
@@ -110,3 +247,112 @@ def test_kernel_method(traj_list, method, expected):
     model = estimator.compute_kernel(method=method)
 
     assert model.kernel.shape == expected
+
+
+@pytest.mark.parametrize("traj_list", ["numpy"], indirect=True)
+@pytest.mark.parametrize("method", ["rect", "midpoint", "midpoint_w_richardson", "trapz", "second_kind_rect", "second_kind_trapz"])
+def test_kernel_method_fft(traj_list, method):
+    estimator = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10, remove_const=False), trunc=10, saveall=False, verbose=False)
+    estimator.compute_mean_force()
+    estimator.compute_corrs()
+
+    kernel = estimator.compute_kernel(method=method).kernel.to_numpy()
+    kernel_fft = estimator.compute_kernel(method=method + "_fft").kernel.to_numpy()
+
+    assert kernel_fft.shape == kernel.shape
+    np.testing.assert_allclose(kernel_fft, kernel, rtol=1e-8, atol=1e-8 * np.abs(kernel).max())
+
+
+@pytest.mark.parametrize("traj_list", ["numpy"], indirect=True)
+@pytest.mark.parametrize("method", ["fft", "rfft", "fft_blocks"])
+def test_dask_chunks(traj_list, method):
+    estimator = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False)
+    estimator.compute_mean_force()
+    estimator.compute_corrs(method=method)
+    ref = {k: np.asarray(getattr(estimator, k)) for k in ["bkdxcorrw", "dotbkdxcorrw", "bkbkcorrw", "dotbkbkcorrw"]}
+    force_coeff = np.asarray(estimator.model.force_coeff)
+
+    chunked = [xva.chunk({"time": 1500}) for xva in traj_list]
+    estimator = vb.Estimator_gle(chunked, vb.Pos_gle, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False)
+    estimator.compute_mean_force()
+    np.testing.assert_allclose(estimator.model.force_coeff, force_coeff, atol=1e-10)
+    estimator.compute_corrs(method=method)
+    for k, val in ref.items():
+        assert not hasattr(getattr(estimator, k).data, "dask")
+        np.testing.assert_allclose(getattr(estimator, k), val, atol=1e-10)
+
+
+@pytest.mark.parametrize("traj_list", ["numpy"], indirect=True)
+@pytest.mark.parametrize("n_jobs", [1, 2])
+@pytest.mark.parametrize("second_order_method", [True, False])
+def test_partial_fit(traj_list, n_jobs, second_order_method, tmp_path):
+    segments = [traj_list[0].isel(time=slice(0, 4000)), traj_list[0].isel(time=slice(4000, None))] + traj_list[1:]
+    batch = vb.Estimator_gle(segments, vb.Pos_gle, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False)
+    batch.compute_mean_force()
+    batch.compute_effective_mass()
+    batch.compute_corrs(second_order_method=second_order_method)
+    batch.compute_gram_kernel()
+
+    # Same fitted basis for the incremental estimator
+    checkpoint = str(tmp_path / "checkpoint")
+    estimator = vb.Estimator_gle(segments[0], vb.Pos_gle, batch.model.basis, trunc=1, saveall=False, verbose=False, n_jobs=n_jobs, checkpoint=checkpoint)
+    estimator.partial_fit(second_order_method=second_order_method)
+    estimator.add_trajectories(segments[1])
+    model = estimator.partial_fit(segments[2:], second_order_method=second_order_method)
+    assert not os.path.exists(checkpoint)
+    for k in ["force_coeff", "eff_mass", "gram_kernel"]:
+        np.testing.assert_allclose(getattr(model, k), getattr(batch.model, k), atol=1e-10)
+    for k in ["bkdxcorrw", "dotbkdxcorrw", "bkbkcorrw", "dotbkbkcorrw"]:
+        np.testing.assert_allclose(getattr(estimator, k), getattr(batch, k), atol=1e-10)
+
+    with pytest.raises(ValueError):
+        estimator.add_trajectories(traj_list[0].isel(time=slice(0, 10)))
+
+
+@pytest.mark.parametrize("traj_list", ["numpy"], indirect=True)
+def test_checkpoint(traj_list, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint")
+    estimator = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False, checkpoint=checkpoint)
+    estimator.compute_mean_force()
+    estimator.compute_effective_mass()
+    estimator.compute_corrs()
+    kernel = estimator.compute_kernel(method="trapz").kernel
+
+    resumed = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False, checkpoint=checkpoint)
+    assert isinstance(resumed.bkbkcorrw.data, np.memmap)
+    np.testing.assert_allclose(resumed.model.force_coeff, estimator.model.force_coeff)
+    np.testing.assert_allclose(resumed.model.eff_mass, estimator.model.eff_mass)
+    np.testing.assert_allclose(resumed.model.kernel, kernel)
+    np.testing.assert_allclose(resumed.model.kernel["time_kernel"], kernel["time_kernel"])
+    for k in ["bkdxcorrw", "dotbkdxcorrw", "bkbkcorrw", "dotbkbkcorrw"]:
+        np.testing.assert_allclose(getattr(resumed, k), getattr(estimator, k))
+    for method in ["rectangular", "second_kind_rect"]:
+        np.testing.assert_allclose(resumed.compute_kernel(method=method).kernel, estimator.compute_kernel(method=method).kernel)
+
+    other = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10), trunc=2, saveall=False, verbose=False)
+    with pytest.raises(ValueError):
+        other.load_checkpoint(checkpoint)
+
+
+@pytest.mark.parametrize("traj_list", ["numpy"], indirect=True)
+def test_corrs_cache(traj_list, tmp_path):
+    estimator = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False)
+    cache = estimator.set_corrs_cache(str(tmp_path))
+    estimator.compute_mean_force()
+    estimator.compute_corrs()
+    ref = {k: np.asarray(getattr(estimator, k)) for k in ["bkdxcorrw", "dotbkdxcorrw", "bkbkcorrw", "dotbkbkcorrw"]}
+    assert cache.misses == 1 and len(cache) == 1
+
+    estimator = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(10), trunc=1, saveall=False, verbose=False)
+    cache = estimator.set_corrs_cache(str(tmp_path), max_size=int(1.2 * cache.size()))
+    estimator.compute_mean_force()
+    estimator.compute_corrs(workers=2)
+    assert cache.hits == 1
+    for k, val in ref.items():
+        np.testing.assert_allclose(getattr(estimator, k), val)
+
+    # Other options give another entry, the least recently used one is evicted
+    estimator.compute_corrs(second_order_method=False)
+    assert cache.misses == 1 and len(cache) == 1
+    estimator.compute_corrs()
+    assert cache.misses == 2
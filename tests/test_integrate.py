@@ -4,3 +4,133 @@ import numpy as np
 import dask.array as da
 import VolterraBasis as vb
 import VolterraBasis.basis as bf
+import xarray as xr
+
+
+@pytest.fixture
+def model_exp_kernel():
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    trj = np.loadtxt(os.path.join(file_dir, "../examples/example_lj.trj"))
+    xva = vb.compute_va(vb.xframe(trj[:, 1], trj[:, 0] - trj[0, 0]))
+    estimator = vb.Estimator_gle(xva, vb.Pos_gle, bf.BSplineFeatures(6), trunc=4, saveall=False, verbose=False)
+    estimator.compute_mean_force()
+    estimator.compute_corrs()
+    model = estimator.compute_kernel(method="trapz")
+    # Replace kernel by exponentials
+    time = model.kernel["time_kernel"].to_numpy()
+    prony_coeffs = [[((1.0 + k), np.array([[-(3.0 + k)]])) for k in range(model.kernel.shape[1])]]
+    kernel = np.stack([y0 * np.exp(A[0, 0] * time) for y0, A in prony_coeffs[0]], axis=-1)[:, :, np.newaxis]
+    model.kernel = xr.DataArray(kernel, dims=model.kernel.dims, coords=model.kernel.coords)
+    return model, xva, prony_coeffs
+
+
+def test_integrator_prony(model_exp_kernel):
+    model, xva, prony_coeffs = model_exp_kernel
+    coeffs_noise = np.ones((model.kernel.shape[1], 1))
+    integrator = vb.Integrator_gle(model, coeffs_noise_kernel=coeffs_noise, verbose=False)
+    integrator_prony = vb.Integrator_gle_prony(model, prony_coeffs=prony_coeffs, coeffs_noise_kernel=coeffs_noise, verbose=False)
+    x0 = integrator.initial_conditions(xva, n_mem=5)
+
+    trj = integrator.run(300, x0, set_noise_to_zero=True)
+    trj_prony = integrator_prony.run(300, x0, set_noise_to_zero=True)
+    np.testing.assert_allclose(trj_prony["x"], trj["x"], atol=1e-6)
+
+    # Kernel fitted from the model
+    integrator_fit = vb.Integrator_gle_prony(model, N_keep=4, coeffs_noise_kernel=coeffs_noise, verbose=False)
+    np.testing.assert_allclose(integrator_fit.run(300, x0, set_noise_to_zero=True)["x"], trj["x"], atol=1e-6)
+
+
+def test_run_ensemble(model_exp_kernel):
+    model, xva, prony_coeffs = model_exp_kernel
+    coeffs_noise = np.ones((model.kernel.shape[1], 1))
+    integrator = vb.Integrator_gle(model, coeffs_noise_kernel=coeffs_noise, verbose=False)
+    x0 = [integrator.initial_conditions(xva, n_mem=5) for _ in range(3)]
+
+    trj_ens = integrator.run_ensemble(3, 200, x0, set_noise_to_zero=True)
+    assert trj_ens["x"].shape == (200, 3, 1)
+    for n in range(3):
+        np.testing.assert_allclose(trj_ens["x"].isel(traj=n), integrator.run(200, x0[n], set_noise_to_zero=True)["x"], atol=1e-10)
+
+    integrator_prony = vb.Integrator_gle_prony(model, prony_coeffs=prony_coeffs, coeffs_noise_kernel=coeffs_noise, verbose=False)
+    trj_prony = integrator_prony.run_ensemble(3, 200, x0, set_noise_to_zero=True)
+    np.testing.assert_allclose(trj_prony["x"], trj_ens["x"], atol=1e-6)
+
+    trj_noise = integrator.run_ensemble(4, 50)
+    assert trj_noise["x"].shape == (50, 4, 1)
+    assert np.all(np.isfinite(trj_noise["x"]))
+
+
+def test_run_save_every(model_exp_kernel):
+    model, xva, prony_coeffs = model_exp_kernel
+    coeffs_noise = np.ones((model.kernel.shape[1], 1))
+    integrator = vb.Integrator_gle(model, coeffs_noise_kernel=coeffs_noise, verbose=False)
+    x0 = integrator.initial_conditions(xva, n_mem=5)
+    trj = integrator.run(1000, x0, set_noise_to_zero=True)
+    trj_strided = integrator.run(1000, x0, set_noise_to_zero=True, save_every=7)
+    assert trj_strided["x"].shape == (143, 1)
+    np.testing.assert_allclose(trj_strided["x"], trj["x"][::7])
+    np.testing.assert_allclose(trj_strided["time"], trj["time"][::7])
+
+
+def test_run_output(model_exp_kernel, tmp_path):
+    model, xva, prony_coeffs = model_exp_kernel
+    coeffs_noise = np.ones((model.kernel.shape[1], 1))
+    integrator = vb.Integrator_gle(model, coeffs_noise_kernel=coeffs_noise, verbose=False)
+    x0 = integrator.initial_conditions(xva, n_mem=5)
+    trj = integrator.run(1000, x0, set_noise_to_zero=True, save_every=3, save_memory=True)
+    trj_file = integrator.run(1000, x0, set_noise_to_zero=True, save_every=3, save_memory=True, output=os.path.join(tmp_path, "trj.nc"), chunk_size=50)
+    assert trj_file["x"].shape == trj["x"].shape
+    np.testing.assert_allclose(trj_file["x"], trj["x"])
+    np.testing.assert_allclose(trj_file["memory"], trj["memory"])
+    np.testing.assert_allclose(trj_file["time"], trj["time"])
+    trj_file.close()
+
+    trj_ens = integrator.run_ensemble(2, 200, x0, save_noise=True, output=os.path.join(tmp_path, "ens.nc"), chunk_size=30)
+    assert trj_ens["noise"].shape == (200, 2, 1)
+    trj_ens.close()
+
+
+def test_noise_stream():
+    time = np.arange(50) * 0.1
+    generator = vb.gle_integrate.ColoredNoiseGenerator(np.exp(-time)[:, np.newaxis, np.newaxis], time)
+    stream = generator.stream(1, block_size=200)
+    np.random.seed(0)
+    noise = np.concatenate([stream(37) for _ in range(40)])[:, 0, 0]
+    np.random.seed(0)
+    white_noise = np.random.normal(size=20 * stream.block_size)
+    len_filter = generator.sqk.shape[0]
+    ref = np.convolve(white_noise, generator.sqk[:, 0, 0])[len_filter - 1 : len_filter - 1 + noise.shape[0]] * np.sqrt(generator.dt)
+    np.testing.assert_allclose(noise, ref, atol=1e-12)
+
+
+def test_matrix_noise_generator():
+    time = np.arange(60) * 0.1
+    kernel = np.exp(-time)[:, np.newaxis, np.newaxis] * np.array([[1.0, 0.5], [0.5, 0.8]]) + 0.05 * np.sin(time)[:, np.newaxis, np.newaxis] * np.array([[0.0, 1.0], [-1.0, 0.0]])
+    generator = vb.gle_integrate.MatrixColoredNoiseGenerator(kernel, time)
+    factor = np.transpose(generator.filter, (0, 2, 1))
+    for n in [0, 3, 10]:  # Circular autocorrelation of the filter gives the kernel
+        np.testing.assert_allclose(np.einsum("jab,jcb->ac", np.roll(factor, -n, axis=0), factor), kernel[n], atol=1e-12)
+    assert generator.generate_ensemble(100, 3).shape == (100, 3, 2)
+
+    # Same filter as the diagonal generator
+    diag_generator = vb.gle_integrate.ColoredNoiseGenerator(kernel[:, :1, :1], time)
+    np.testing.assert_allclose(vb.gle_integrate.MatrixColoredNoiseGenerator(kernel[:, :1, :1], time).stream().filter_hat, diag_generator.stream().filter_hat, atol=1e-10)
+
+
+def test_karhunen_loeve_stationary():
+    time = np.arange(40) * 0.1
+    kernel = np.exp(-time) * np.cos(2 * time)
+    generator = vb.KarhunenLoeveNoiseGenerator(kernel, 0.1, stationary=True)
+    assert generator.generate(500).shape == (500,)
+    # The circulant embedding contains the covariance
+    np.testing.assert_allclose(np.fft.ifft(generator._circulant_eigvals(100)).real[:40], kernel, atol=1e-12)
+    # Autocorrelation of the streaming filter is the kernel
+    stream = generator.stream(2)
+    factor = np.fft.irfft(stream.filter_hat[:, 0, 0], n=stream.n_fft)[:40]
+    np.testing.assert_allclose([factor[m:] @ factor[: 40 - m] for m in range(40)], kernel, atol=1e-10)
+    assert stream(1000).shape == (1000, 2, 1)
+
+    with pytest.raises(ValueError, match="stationary=True"):
+        vb.KarhunenLoeveNoiseGenerator(np.diag(kernel), 0.1).generate(50)
+    with pytest.warns(UserWarning, match="not positive"):
+        vb.KarhunenLoeveNoiseGenerator(np.where(time < 0.5, 1.0, 0.0), 0.1, stationary=True).stream()
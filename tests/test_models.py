@@ -133,6 +133,79 @@ def test_pos_gle_w_friction(traj_list, basis, parameters):
     np.testing.assert_allclose(kernel.values, new_kernel.values)
 
 
+@pytest.mark.parametrize("traj_list", ["numpy", "dask"], indirect=True)
+def test_basis_cache(traj_list, tmp_path):
+    estimator = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(8), trunc=1, saveall=False, verbose=False)
+    ref = estimator.model.basis_vector(traj_list[0])
+    cache = estimator.model.set_basis_cache(maxsize=2, location=str(tmp_path))
+    estimator.compute_mean_force()
+    estimator.compute_corrs()
+    misses = cache.misses
+    estimator.compute_corrs()
+    assert cache.misses == misses and cache.hits > 0
+    assert len(cache) <= 2
+
+    cached = estimator.model.basis_vector(traj_list[0])
+    for val, val_ref in zip(cached, ref):
+        np.testing.assert_allclose(val, val_ref)
+
+    # A new cache reuse evaluations stored on disk
+    cache = estimator.model.set_basis_cache(maxsize=2, location=str(tmp_path))
+    estimator.model.basis_vector(traj_list[0])
+    assert cache.hits == 1 and cache.misses == 0
+
+    # Trajectories are fingerprinted once, lazy state of the basis does not change the key
+    assert len(cache._fingerprints) == 1
+    estimator.model.basis.antiderivative(np.asarray(traj_list[0]["x"]))
+    estimator.model.basis_vector(traj_list[0])
+    assert cache.hits == 2 and cache.misses == 0
+
+    # Changing the output dimension or the basis invalidate the cache
+    estimator.model.dim_obs = 2
+    estimator.model.basis_vector(traj_list[0])
+    assert cache.misses == 1
+    estimator.model.dim_obs = 1
+    estimator.model.basis = bf.BSplineFeatures(8).fit(2.0 * np.asarray(traj_list[0]["x"]))
+    estimator.model.basis_vector(traj_list[0])
+    assert cache.misses == 2
+
+    assert "basis_cache" not in estimator.model.save_model()
+
+
+@pytest.mark.parametrize("traj_list", ["numpy", "dask"], indirect=True)
+@pytest.mark.parametrize("method", ["rect", "trapz"])
+def test_noise_fft(traj_list, method):
+    estimator = vb.Estimator_gle(traj_list, vb.Pos_gle, bf.BSplineFeatures(8), trunc=1, saveall=False, verbose=False)
+    estimator.compute_mean_force()
+    estimator.compute_corrs()
+    model = estimator.compute_kernel(method=method)
+
+    time, noise, a, force, mem = model.compute_noise(traj_list[0])
+    time_fft, noise_fft, a_fft, force_fft, mem_fft = model.compute_noise(traj_list[0], conv_method="fft")
+
+    np.testing.assert_allclose(mem_fft, mem, atol=1e-10 * np.abs(mem).max())
+    np.testing.assert_allclose(noise_fft, noise, atol=1e-10 * np.abs(mem).max())
+
+    time, corrs = model.compute_corrs_w_noise(traj_list[0])
+    time_fft, corrs_fft = model.compute_corrs_w_noise(traj_list[0], conv_method="fft")
+    assert corrs_fft.shape == corrs.shape
+    np.testing.assert_allclose(corrs_fft, corrs, atol=1e-10 * np.abs(corrs).max())
+
+    def left_op(xva):
+        return np.column_stack((np.asarray(xva["v"])[:, 0], np.asarray(xva["x"])[:, 0] ** 2))
+
+    for op in ["v", left_op]:
+        time, corrs = model.compute_corrs_w_noise(traj_list[0], left_op=op)
+        time_fft, corrs_fft = model.compute_corrs_w_noise(traj_list[0], left_op=op, conv_method="fft")
+        assert corrs_fft.shape == corrs.shape
+        np.testing.assert_allclose(corrs_fft, corrs, atol=1e-10 * np.abs(corrs).max())
+
+    time, corrs = estimator.compute_projected_corrs(left_op=left_op)
+    time_fft, corrs_fft = estimator.compute_projected_corrs(left_op=left_op, conv_method="fft")
+    assert corrs_fft.shape[1:] == (2, 1)
+    np.testing.assert_allclose(corrs_fft, corrs, atol=1e-10 * np.abs(corrs).max())
+
+
 @pytest.mark.skip(reason="FEM not working or now")
 @pytest.mark.parametrize("model", [vb.Pos_gle, vb.Pos_gle_no_vel_basis, vb.Pos_gle_const_kernel, vb.Pos_gle_overdamped, vb.Pos_gle_hybrid])
 def test_fem(model):